@@ -23,21 +23,22 @@ import io
 import stat
 import struct
 import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from ctypes import sizeof
-try:
-    from functools import lru_cache
-except ImportError:
-    def lru_cache(maxsize=128, typed=False):
-        return lambda user_function: user_function
-
+from .cache import BlockCache
 from .compressor import compressors
 from .const import (
     SQUASHFS_INVALID_BLK,
     SQUASHFS_INVALID_FRAG,
     SQUASHFS_METADATA_SIZE,
+    SQUASHFS_XATTR_PREFIX_MASK,
+    SQUASHFS_XATTR_VALUE_OOL,
+    XATTR_PREFIXES,
     Type,
 )
-from .file import Directory, filetype
+from .file import Directory, RawBlock, filetype
 from .macro import (
     SQUASHFS_CHECK_DATA,
     SQUASHFS_COMPRESSED,
@@ -51,13 +52,19 @@ from .macro import (
     SQUASHFS_ID_BYTES,
     SQUASHFS_INODE_BLK,
     SQUASHFS_INODE_OFFSET,
+    SQUASHFS_XATTR_BLK,
     SQUASHFS_XATTR_BLOCK_BYTES,
     SQUASHFS_XATTR_BLOCKS,
     SQUASHFS_XATTR_BYTES,
+    SQUASHFS_XATTR_OFFSET,
 )
-from .structure import DirEntry, DirHeader, FragmentEntry, Superblock, XattrId, XattrTable
+from .memory import memory_usage
+from .plan import Plan, kind
+from .stats import SharedCounter, Stats, clock
+from .tracing import span, trace_iter
+from .structure import DirEntry, DirHeader, FragmentEntry, Superblock, XattrEntry, XattrId, XattrTable, XattrVal
 from .structure.inode import InodeHeader, inomap
-from .util import check_super
+from .util import DECODE_ERRORS, check_super
 
 
 SQUASHFS_LOOKUP_TYPE = [
@@ -81,19 +88,38 @@ SQUASHFS_LOOKUP_TYPE = [
 
 class SquashFsImage(object):
 
-    def __init__(self, fd, offset=0, closefd=True):
+    def __init__(self, fd, offset=0, closefd=True, stats=False, tracer=None, budget=None):
         self._fd = fd
         self._offset = offset
         self._closefd = closefd
         self._sblk = None
         self._root = None
         self._comp = None
-        self._inode_table_hash = {}
-        self._directory_table_hash = {}
+        # Metadata and data blocks are cached, within the cache.MemoryBudget `budget` if given.
+        self._inode_table_cache = BlockCache(None, budget, "inode table")
+        self._directory_table_cache = BlockCache(None, budget, "directory table")
         self._fragment_table = []
         self._id_table = {}
         self._hash_table = {}
         self._xattrs = b""
+        self._xattr_table_start = None
+        self._xattr_ids = []
+        self._xattr_cache = {}
+        self._fragment_usage_cache = None
+        # Decompressed data and fragment blocks, by (position, size) as in block lists.
+        self._data_cache = BlockCache(256, budget, "data")
+        # Serializes seek() + read() on self._fd so files can be read from several threads,
+        # and the updates of self._stats.
+        self._lock = threading.Lock()
+        self._position = None  # Where the last read from the image ended.
+        # Bytes read from the image and produced by decompression since it was opened,
+        # counted without locking so that decompressing threads don't wait for each other.
+        self._read_counter = SharedCounter()
+        self._decompressed_counter = SharedCounter()
+        # Stats being collected, None when they aren't so that counting costs a single test.
+        self._stats = Stats(self) if stats else None
+        # A tracing.Tracer receiving spans, also checked against None on hot paths.
+        self.tracer = tracer
         self._initialize()
 
     def __enter__(self):
@@ -102,6 +128,8 @@ class SquashFsImage(object):
     def __exit__(self, exc_type, exc_value, traceback):
         if self._closefd:
             self.close()
+        else:
+            self._release_caches()
 
     def __iter__(self):
         return self._root.riter()
@@ -119,17 +147,66 @@ class SquashFsImage(object):
         """Filesystem size in bytes."""
         return self._sblk.bytes_used
 
+    @property
+    def _bytes_read(self):
+        return self._read_counter.value
+
+    @property
+    def _bytes_decompressed(self):
+        return self._decompressed_counter.value
+
     @classmethod
-    def from_bytes(cls, bytes_, offset=0):
-        return cls(io.BytesIO(bytes_), offset)
+    def from_bytes(cls, bytes_, offset=0, stats=False, tracer=None, budget=None):
+        return cls(io.BytesIO(bytes_), offset, stats=stats, tracer=tracer, budget=budget)
 
     @classmethod
-    def from_file(cls, path, offset=0):
-        return cls(open(path, "rb"), offset)
+    def from_file(cls, path, offset=0, stats=False, tracer=None, budget=None):
+        return cls(open(path, "rb"), offset, stats=stats, tracer=tracer, budget=budget)
 
     def close(self):
         self._fd.close()
         self._fd = None
+        self._release_caches()
+
+    def _release_caches(self):
+        # Give the memory back to the budget, if any, rather than waiting for eviction,
+        # which also stops the budget from referencing the caches.
+        for cache in (self._inode_table_cache, self._directory_table_cache, self._data_cache):
+            cache.clear()
+
+    def stats(self):
+        """Return the runtime counters as a dictionary, see stats.Stats.snapshot().
+
+        Only bytes read and decompressed are counted unless the image was opened with `stats`
+        set to true or collect_stats() is in use, in which case the counts are those collected.
+        """
+        if self._stats is not None:
+            return self._stats.snapshot()
+        stats = Stats(self)
+        stats._read = stats._decompressed = 0  # Since the image was opened.
+        return stats.snapshot()
+
+    @contextmanager
+    def collect_stats(self):
+        """Context manager collecting runtime counters from scratch for the duration
+        of the block, yielding a stats.Stats whose values are kept at the end.
+
+        Collections don't nest: an inner one gets the counts while it lasts.
+        """
+        previous = self._stats
+        stats = self._stats = Stats(self)
+        try:
+            yield stats
+        finally:
+            stats.stop()
+            self._stats = previous
+
+    def memory_usage(self):
+        """Return an OrderedDict estimating the bytes held, from sys.getsizeof(), by the File objects
+        ("tree"), the decoded inodes, the metadata and data block caches, the fragment table,
+        the ID table and the xattr table with its decoded sets, and their "total".
+        """
+        return memory_usage(self)
 
     def _read_super(self):
         self._sblk = Superblock.from_fd(self._fd)
@@ -144,49 +221,349 @@ class SquashFsImage(object):
 
     def _initialize(self):
         self._fd.seek(self._offset)
-        self._read_super()
-        self._read_uids_guids()
-        self._read_fragment_table()
-        self._read_xattrs_from_disk()
+        phases = (self._read_super, self._read_uids_guids, self._read_fragment_table, self._read_xattrs_from_disk)
+        for phase in phases:
+            with span(self.tracer, phase.__name__.lstrip('_')):
+                phase()
         root_block = SQUASHFS_INODE_BLK(self._sblk.root_inode)
         root_offs = SQUASHFS_INODE_OFFSET(self._sblk.root_inode)
-        self._root = self._dir_scan(root_block, root_offs)
+        with span(self.tracer, "dir_scan"):
+            self._root = self._dir_scan(root_block, root_offs)
+
+    def _read(self, start, size):
+        """Read `size` bytes at offset `start` relative to the start of the image."""
+        tracer = self.tracer
+        if tracer is not None:
+            token = tracer.start("read", {"offset": start, "size": size})
+        with self._lock:
+            self._fd.seek(self._offset + start)
+            self._read_counter.add(size)
+            if self._stats is not None:
+                self._stats.reads += 1
+                if start != self._position:
+                    self._stats.seeks += 1
+            self._position = start + size
+            data = self._fd.read(size)
+        if tracer is not None:
+            tracer.end(token)
+        return data
+
+    def _count(self, read=0, decompressed=0, start=None):
+        """Account for data read from the image or decompressed without _read().
+
+        `start` is the offset of the data read relative to the start of the image,
+        when known it is tracked as _read() does.
+        """
+        if read:
+            self._read_counter.add(read)
+            if self._stats is not None or start is not None:
+                with self._lock:
+                    if self._stats is not None:
+                        self._stats.reads += 1
+                        if start is not None and start != self._position:
+                            self._stats.seeks += 1
+                    if start is not None:
+                        self._position = start + read
+        if decompressed:
+            self._decompressed_counter.add(decompressed)
+
+    def _count_lookup(self, cache, miss):
+        """Account for a lookup in one of the stats.CACHES while collecting stats."""
+        with self._lock:
+            self._stats.lookups[cache] += 1
+            if miss:
+                self._stats.misses[cache] += 1
+
+    def _uncompress(self, data, size, expected):
+        tracer = self.tracer
+        stats = self._stats
+        if stats is None and tracer is None:
+            block = self._comp.uncompress(data, size, expected)
+            self._count(decompressed=len(block))
+            return block
+        if tracer is not None:
+            token = tracer.start("decompress", {"compressor": self._comp.name, "size": size})
+        start = clock()
+        block = self._comp.uncompress(data, size, expected)
+        elapsed = clock() - start
+        if tracer is not None:
+            tracer.end(token)
+        self._decompressed_counter.add(len(block))
+        if stats is not None:
+            with self._lock:
+                stats.decompression_time[self._comp.name] += elapsed
+        return block
 
-    @lru_cache(maxsize=256)
     def _read_data_block(self, start, size):
+        block = self._data_cache.get((start, size))
+        if self._stats is not None:
+            self._count_lookup(self._data_cache.name, block is None)
+        if block is None:
+            block = self._load_data_block(start, size)
+            self._data_cache.put((start, size), block)
+        return block
+
+    def _load_data_block(self, start, size):
         c_byte = SQUASHFS_COMPRESSED_SIZE_BLOCK(size)
-        self._fd.seek(self._offset + start)
-        data = self._fd.read(c_byte)
-        if SQUASHFS_COMPRESSED_BLOCK(size):
-            return self._comp.uncompress(data, c_byte, self._sblk.block_size)
-        else:
-            return data
+        tracer = self.tracer
+        if tracer is not None:
+            token = tracer.start("data_block", {"offset": start, "size": c_byte})
+        try:
+            data = self._read(start, c_byte)
+            if SQUASHFS_COMPRESSED_BLOCK(size):
+                if self._stats is not None:
+                    with self._lock:
+                        self._stats.data_blocks += 1
+                return self._uncompress(data, c_byte, self._sblk.block_size)
+            else:
+                return data
+        finally:
+            if tracer is not None:
+                tracer.end(token)
+
+    def _fileno(self):
+        """Return the file descriptor of the image if it is a plain file, otherwise None."""
+        if not isinstance(self._fd, (io.FileIO, io.BufferedReader)):
+            return None
+        try:
+            return self._fd.fileno()
+        except (IOError, OSError, ValueError):
+            return None
 
     def iter_file(self, inode):
+        if self.tracer is not None:
+            return trace_iter(self.tracer, "read_file", self._iter_file(inode), {"inode": inode.inode_number})
+        return self._iter_file(inode)
+
+    def _iter_file(self, inode, raw=False, sparse=False, block_list=None):
+        """Iterate over the content of a regular file inode.
+
+        If `raw` is true, data blocks stored uncompressed are not read but
+        yielded as (offset, size) tuples, `offset` being relative to the start
+        of the underlying file, so they can be copied by the caller.
+        If `sparse` is true, sparse blocks are yielded as their size
+        rather than as zeros, so the caller can skip them.
+        `block_list` is the block list of the inode if the caller already read it.
+        """
         # unsquashfs.c -> write_file
         start = inode.start
         file_end = inode.data // self._sblk.block_size
         if inode.blocks:
-            block_list = self._read_block_list(inode.block_start, inode.block_offset, inode.blocks)
+            if block_list is None:
+                block_list = self._read_block_list(inode.block_start, inode.block_offset, inode.blocks)
             for i, block in enumerate(block_list):
                 if block == SQUASHFS_INVALID_FRAG:
                     continue
                 if block:  # non sparse file
-                    yield self._read_data_block(start, block)
+                    if raw and not SQUASHFS_COMPRESSED_BLOCK(block):
+                        yield self._offset + start, SQUASHFS_COMPRESSED_SIZE_BLOCK(block)
+                    else:
+                        yield self._read_data_block(start, block)
                     start += SQUASHFS_COMPRESSED_SIZE_BLOCK(block)
                 else:
                     if i == file_end:
-                        yield b'\x00' * (inode.data & (self._sblk.block_size - 1))
+                        size = inode.data & (self._sblk.block_size - 1)
                     else:
-                        yield b'\x00' * self._sblk.block_size
+                        size = self._sblk.block_size
+                    yield size if sparse else b'\x00' * size
         if inode.frag_bytes:
             start, size = self._read_fragment(inode.fragment)
             buffer = self._read_data_block(start, size)
             yield buffer[inode.offset : inode.offset + inode.frag_bytes]
 
+    def _iter_ranges(self, inode, block_list=None):
+        """Iterate over the data and the holes of a regular file inode as
+        (offset, size, hole) tuples, using its block list only.
+
+        Adjacent ranges of the same kind are merged.
+        """
+        offset = 0
+        size = 0
+        hole = False
+        if inode.blocks:
+            if block_list is None:
+                block_list = self._read_block_list(inode.block_start, inode.block_offset, inode.blocks)
+            for block in block_list:
+                if block == SQUASHFS_INVALID_FRAG:
+                    continue
+                length = min(self._sblk.block_size, inode.data - offset - size)
+                if size and hole != (block == 0):
+                    yield offset, size, hole
+                    offset += size
+                    size = 0
+                hole = block == 0
+                size += length
+        if inode.frag_bytes:
+            if size and hole:
+                yield offset, size, hole
+                offset += size
+                size = 0
+            hole = False
+            size += inode.frag_bytes
+        if size:
+            yield offset, size, hole
+
+    def _iter_raw_blocks(self, inode, read=False):
+        block_size = self._sblk.block_size
+        start = inode.start
+        if inode.blocks:
+            block_list = self._read_block_list(inode.block_start, inode.block_offset, inode.blocks)
+            for i, block in enumerate(block_list):
+                if block == SQUASHFS_INVALID_FRAG or not block:
+                    continue
+                size = SQUASHFS_COMPRESSED_SIZE_BLOCK(block)
+                yield RawBlock(
+                    start,
+                    size,
+                    bool(SQUASHFS_COMPRESSED_BLOCK(block)),
+                    min(block_size, inode.data - i * block_size),
+                    False,
+                    self._read(start, size) if read else None,
+                )
+                start += size
+        if inode.frag_bytes:
+            yield self._raw_fragment(inode.fragment, read)
+
+    def _raw_fragment(self, fragment, read=False):
+        start, size = self._read_fragment(fragment)
+        c_size = SQUASHFS_COMPRESSED_SIZE_BLOCK(size)
+        data = self._read(start, c_size) if read else None
+        return RawBlock(start, c_size, bool(SQUASHFS_COMPRESSED_BLOCK(size)), None, True, data)
+
+    def iter_all_blocks(self, read=False):
+        """Iterate over all the data blocks and fragment blocks of the image as RawBlocks,
+        sorted by offset, without decompressing them.
+
+        Blocks shared by several files, like duplicates and hard links, are only yielded once.
+        If `read` is true, the compressed bytes are read too.
+        """
+        blocks = {}
+        for file in self._root.riter():
+            if file.is_file:
+                for block in self._iter_raw_blocks(file.inode):
+                    if not block.fragment:
+                        blocks[block.offset] = block
+        for fragment in range(len(self._fragment_table)):
+            block = self._raw_fragment(fragment)
+            blocks[block.offset] = block
+        for offset in sorted(blocks):
+            block = blocks[offset]
+            if read:
+                block = block._replace(data=self._read(block.offset, block.compressed_size))
+            yield block
+
     def read_file(self, inode):
         return b''.join(self.iter_file(inode))
 
+    def _data_position(self, inode):
+        """Return a sort key locating the first data of a regular file inode in the image.
+
+        Files whose data only lives in a fragment block get the position of that block,
+        so files sharing it are sorted next to each other, by offset in the block.
+        """
+        if inode.blocks:
+            return inode.start, 0
+        if inode.frag_bytes:
+            return self._fragment_table[inode.fragment].start_block, inode.offset
+        return 0, 0
+
+    def iter_files_by_disk_order(self, subtree=None):
+        """Iterate over the regular files of `subtree` (the root directory by default)
+        in the order their data is stored in the image.
+
+        This turns scattered reads into mostly sequential ones, and fragment blocks
+        are only decompressed once for all the files they contain.
+        """
+        subtree = self._root if subtree is None else subtree
+        files = subtree.riter() if subtree.is_dir else [subtree]
+        files = [file for file in files if file.is_file]
+        files.sort(key=lambda file: self._data_position(file.inode))
+        for file in files:
+            yield file
+
+    def plan(self, subtree=None, path_filter=None):
+        """Return a Plan of what extracting `subtree` (the root directory by default),
+        optionally filtered by a filters.PathFilter, would read, decompress and write.
+
+        Only inodes, block lists and the fragment table are looked at,
+        no data block is read.
+        """
+        subtree = self._root if subtree is None else subtree
+        if not subtree.is_dir:
+            files = [subtree]
+        elif path_filter is not None:
+            files = path_filter.walk(subtree)
+        else:
+            files = subtree.riter()
+        plan = Plan()
+        linked = set()
+        fragments = set()
+        for file in files:
+            plan.types[kind(file)] += 1
+            inode = file.inode
+            if not file.is_dir and inode.nlink > 1:
+                if inode.inode_number in linked:
+                    plan.hard_links += 1
+                    if file.is_file:
+                        plan.bytes_saved_by_links += inode.data
+                    continue
+                linked.add(inode.inode_number)
+            if not file.is_file:
+                continue
+            plan.bytes_to_write += inode.data
+            if inode.blocks:
+                for block in self._read_block_list(inode.block_start, inode.block_offset, inode.blocks):
+                    if block == SQUASHFS_INVALID_FRAG:
+                        continue
+                    if not block:
+                        plan.sparse_blocks += 1
+                        continue
+                    plan.data_blocks += 1
+                    plan.bytes_to_read += SQUASHFS_COMPRESSED_SIZE_BLOCK(block)
+                    if SQUASHFS_COMPRESSED_BLOCK(block):
+                        plan.blocks_to_decompress += 1
+            if inode.frag_bytes and inode.fragment not in fragments:
+                fragments.add(inode.fragment)
+                _, size = self._read_fragment(inode.fragment)
+                plan.bytes_to_read += SQUASHFS_COMPRESSED_SIZE_BLOCK(size)
+                if SQUASHFS_COMPRESSED_BLOCK(size):
+                    plan.blocks_to_decompress += 1
+        plan.fragment_blocks = len(fragments)
+        return plan
+
+    def _fragment_usage(self):
+        """Return a dictionary mapping the index of each fragment block to the number of bytes
+        the files of the image store in it and where the last of them ends.
+        """
+        if self._fragment_usage_cache is None:
+            usage = {}
+            seen = set()
+            for file in self._root.riter():
+                inode = file.inode
+                if not file.is_file or not inode.frag_bytes or (inode.fragment, inode.offset) in seen:
+                    continue
+                # Duplicate files share their tail.
+                seen.add((inode.fragment, inode.offset))
+                used, end = usage.get(inode.fragment, (0, 0))
+                usage[inode.fragment] = used + inode.frag_bytes, max(end, inode.offset + inode.frag_bytes)
+            self._fragment_usage_cache = usage
+        return self._fragment_usage_cache
+
+    def _compressed_size(self, inode):
+        """Return the size a regular file inode's data takes in the image, including the share
+        of its fragment block in proportion to the bytes it stores there.
+        """
+        size = 0
+        if inode.blocks:
+            for block in self._read_block_list(inode.block_start, inode.block_offset, inode.blocks):
+                if block != SQUASHFS_INVALID_FRAG:
+                    size += SQUASHFS_COMPRESSED_SIZE_BLOCK(block)
+        if inode.frag_bytes:
+            _, fragment_size = self._read_fragment(inode.fragment)
+            used, _ = self._fragment_usage()[inode.fragment]
+            size += SQUASHFS_COMPRESSED_SIZE_BLOCK(fragment_size) * inode.frag_bytes // used
+        return size
+
     def _read_block_list(self, start, offset, blocks):
         # unsquash-4.c
         size = 4  # sizeof(unsigned int)
@@ -204,14 +581,22 @@ class SquashFsImage(object):
         Return the uncompressed block and the start of the next compressed one.
         """
         # unsquashfs.c
-        self._fd.seek(self._offset + start)
-        c_byte = self._read_short()
-        offset = 3 if SQUASHFS_CHECK_DATA(self._sblk.flags) else 2
-        self._fd.seek(self._offset + start + offset)
-        size = SQUASHFS_COMPRESSED_SIZE(c_byte)
-        block = self._fd.read(size)
-        if SQUASHFS_COMPRESSED(c_byte):
-            block = self._comp.uncompress(block, size, expected)
+        tracer = self.tracer
+        if tracer is not None:
+            token = tracer.start("metadata_block", {"offset": start})
+        try:
+            c_byte = struct.unpack("<H", self._read(start, 2))[0]
+            offset = 3 if SQUASHFS_CHECK_DATA(self._sblk.flags) else 2
+            size = SQUASHFS_COMPRESSED_SIZE(c_byte)
+            block = self._read(start + offset, size)
+            if SQUASHFS_COMPRESSED(c_byte):
+                if self._stats is not None:
+                    with self._lock:
+                        self._stats.metadata_blocks += 1
+                block = self._uncompress(block, size, expected)
+        finally:
+            if tracer is not None:
+                tracer.end(token)
         return block, start + offset + size
 
     def _read_fragment_table(self):
@@ -242,6 +627,9 @@ class SquashFsImage(object):
 
     def _read_inode(self, start_block, offset):
         # unsquash-4.c
+        if self._stats is not None:
+            with self._lock:
+                self._stats.inodes += 1
         start = self._sblk.inode_table_start + start_block
         idata, start, offset = self._read_inode_data(start, offset, sizeof(InodeHeader))
         header = InodeHeader.from_bytes(idata)
@@ -275,6 +663,9 @@ class SquashFsImage(object):
 
     def _opendir(self, block_start, offset):
         # unsquash-4.c -> squashfs_opendir
+        if self._stats is not None:
+            with self._lock:
+                self._stats.directories += 1
         inode = self._read_inode(block_start, offset)
         directory = Directory(self, inode)
         directory.entries = []
@@ -337,30 +728,69 @@ class SquashFsImage(object):
         for _ in range(indexes):
             index.append(self._make_integer(SQUASHFS_XATTR_BLOCK_BYTES(1)))
         bytes_ = SQUASHFS_XATTR_BYTES(ids)
-        xattr_ids = {}
         for i, idx in enumerate(index):
             if (i + 1) != indexes:
                 expected = SQUASHFS_METADATA_SIZE
             else:
                 expected = bytes_ & (SQUASHFS_METADATA_SIZE - 1)
             block = self._read_block(idx, expected)[0]
-            cur_idx = (i * SQUASHFS_METADATA_SIZE) / 16
             ofs = 0
             while ofs < len(block):
-                xattr_ids[cur_idx] = XattrId.from_bytes(block, ofs)
-                cur_idx += 1
+                self._xattr_ids.append(XattrId.from_bytes(block, ofs))
                 ofs += sizeof(XattrId)
+        self._xattr_table_start = xattr_table_start
         start = xattr_table_start
-        i = 0
-        while start < index[0]:
-            self._hash_table[start] = i * SQUASHFS_METADATA_SIZE
+        blocks = []
+        while index and start < index[0]:
+            self._hash_table[start] = len(blocks) * SQUASHFS_METADATA_SIZE
             block, start = self._read_block(start)
-            for i in range(len(block), SQUASHFS_METADATA_SIZE):
-                block += b'\x00'
-            self._xattrs += block
-            i += 1
+            blocks.append(block.ljust(SQUASHFS_METADATA_SIZE, b'\x00'))
+        self._xattrs = b''.join(blocks)
         return ids
 
+    def _xattr_position(self, ref):
+        """Return the position in the uncompressed xattr table of an xattr reference."""
+        return self._hash_table[self._xattr_table_start + SQUASHFS_XATTR_BLK(ref)] + SQUASHFS_XATTR_OFFSET(ref)
+
+    def _get_xattrs(self, index):
+        """Return the extended attributes at `index` in the xattr id table as a dictionary.
+
+        Sets of attributes are usually shared by many files, so they are
+        decoded once and the same dictionary is returned afterwards.
+        """
+        # read_xattrs.c -> get_xattr
+        if self._stats is not None:
+            self._count_lookup("xattrs", index not in self._xattr_cache)
+        try:
+            return self._xattr_cache[index]
+        except KeyError:
+            pass
+        xattrs = OrderedDict()
+        xattr_id = self._xattr_ids[index]
+        ofs = self._xattr_position(xattr_id.xattr)
+        for _ in range(xattr_id.count):
+            entry = XattrEntry.from_bytes(self._xattrs, ofs)
+            ofs += sizeof(XattrEntry)
+            name = self._xattrs[ofs : ofs + entry.size]
+            ofs += entry.size
+            prefix = XATTR_PREFIXES.get(entry.type & SQUASHFS_XATTR_PREFIX_MASK)
+            value = XattrVal.from_bytes(self._xattrs, ofs)
+            ofs += sizeof(XattrVal)
+            if entry.type & SQUASHFS_XATTR_VALUE_OOL:
+                # The value is stored elsewhere, this one is a reference to it.
+                vofs = self._xattr_position(self._make_buf_integer(self._xattrs, ofs, value.vsize))
+                ofs += value.vsize
+                value = XattrVal.from_bytes(self._xattrs, vofs)
+                vofs += sizeof(XattrVal)
+            else:
+                vofs = ofs
+                ofs += value.vsize
+            if prefix is None:
+                continue  # Unknown prefix, unsquashfs ignores it too.
+            xattrs[prefix + name.decode("utf8", DECODE_ERRORS)] = self._xattrs[vofs : vofs + value.vsize]
+        self._xattr_cache[index] = xattrs
+        return xattrs
+
     def _dir_scan(self, start_block, offset):
         directory = self._opendir(start_block, offset)
         for entry in directory.entries:  # No need for squashfs_readdir()
@@ -404,35 +834,38 @@ class SquashFsImage(object):
     def _read_long(self):
         return self._read_integer("<Q")
 
-    def _get_metadata(self, hash_table, start):
-        try:
-            return hash_table[start]
-        except KeyError:
-            hash_table[start] = dict(zip(("buffer", "next_index"), self._read_block(start)))
-            return hash_table[start]
-
-    def _read_metadata(self, hash_table, block, offset, length):
+    def _get_metadata(self, cache, start):
+        """Return the metadata block at `start` and the position of the next one."""
+        entry = cache.get(start)
+        if self._stats is not None:
+            self._count_lookup(cache.name, entry is None)
+        if entry is None:
+            entry = self._read_block(start)
+            cache.put(start, entry, len(entry[0]))
+        return entry
+
+    def _read_metadata(self, cache, block, offset, length):
         data = b''
         while True:
-            entry = self._get_metadata(hash_table, block)
-            copy = len(entry["buffer"]) - offset
+            buffer, next_index = self._get_metadata(cache, block)
+            copy = len(buffer) - offset
             if copy < length:
-                data += entry["buffer"][offset:]
+                data += buffer[offset:]
                 length -= copy
-                block = entry["next_index"]
+                block = next_index
                 offset = 0
             elif copy == length:
-                data += entry["buffer"][offset : offset + length]
-                return data, entry["next_index"], 0
+                data += buffer[offset : offset + length]
+                return data, next_index, 0
             else:
-                data += entry["buffer"][offset : offset + length]
+                data += buffer[offset : offset + length]
                 return data, block, offset + length
 
     def _read_inode_data(self, block, offset, length):
-        return self._read_metadata(self._inode_table_hash, block, offset, length)
+        return self._read_metadata(self._inode_table_cache, block, offset, length)
 
     def _read_directory_data(self, block, offset, length):
-        return self._read_metadata(self._directory_table_hash, block, offset, length)
+        return self._read_metadata(self._directory_table_cache, block, offset, length)
 
     def find(self, filename):
         return self._root.find(filename)
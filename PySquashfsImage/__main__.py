@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 import argparse
+import json
 import os
 import posixpath
 import sys
+from collections import OrderedDict
 from datetime import datetime, timedelta
 try:
     from datetime import timezone
@@ -20,16 +22,79 @@ else:
 
 from . import SquashFsImage, __version__
 from .const import Compression
+from .diff import diff as diff_trees
+from .export import export_tar
 from .extract import extract_dir, extract_file
 from .file import BlockDevice, CharacterDevice
+from .filters import PathFilter, read_patterns
+from .manifest import hash_tree
+from .stats import clock
+from .storage import storage_stats
+from .tracing import ChromeTracer
 from .util import find_superblocks
+from .verify import verify as verify_image
 
 DTFMT = "%Y-%m-%d %H:%M:%S"
 ROOT = posixpath.sep
 
 
+def _path_filter(args):
+    include = list(args.include or [])
+    exclude = list(args.exclude or [])
+    for path in args.include_from or []:
+        include.extend(read_patterns(path))
+    for path in args.exclude_from or []:
+        exclude.extend(read_patterns(path))
+    if not include and not exclude:
+        return None
+    return PathFilter(include, exclude)
+
+
+def _format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = "TiB"
+    return "{:.1f} {}".format(size, unit) if unit != "B" else "{} B".format(int(size))
+
+
+class ProgressLine(object):
+    """Extraction progress callback redrawing one line on stderr, at most every `interval` seconds."""
+
+    def __init__(self, interval=0.5):
+        self._interval = interval
+        self._last = None
+        self._width = 0
+
+    def __call__(self, progress):
+        now = clock()
+        if not progress.done and self._last is not None and now - self._last < self._interval:
+            return
+        self._last = now
+        elapsed = sum(progress.elapsed.values())
+        line = "{}: {}/{} files, {} written, {} read, {} decompressed, {}/s".format(
+            progress.phase,
+            progress.files,
+            progress.files_total,
+            _format_size(progress.bytes_written),
+            _format_size(progress.bytes_read),
+            _format_size(progress.bytes_decompressed),
+            _format_size(progress.bytes_written / elapsed if elapsed else 0),
+        )
+        sys.stderr.write("\r" + line.ljust(self._width))
+        self._width = len(line)
+        if progress.done:
+            sys.stderr.write("\n" + ", ".join(
+                "{} {:.2f}s".format(phase, seconds) for phase, seconds in progress.elapsed.items()
+            ) + "\n")
+        sys.stderr.flush()
+
+
 def extract(args):
-    with SquashFsImage.from_file(args.file, args.offset) as image:
+    tracer = ChromeTracer() if args.trace else None
+    with SquashFsImage.from_file(args.file, args.offset, tracer=tracer) as image:
         file = image.select(args.path)
         if file is None:
             raise Exception("{} not found".format(args.path))
@@ -40,9 +105,117 @@ def extract(args):
         if dirname and not os.path.isdir(dirname):
             os.makedirs(dirname)
         if file.is_dir:
-            extract_dir(file, dest, args.force, quiet=args.quiet)
+            summary = extract_dir(file, dest, args.force, quiet=args.quiet or args.progress, jobs=args.jobs,
+                                  incremental=args.incremental, checksum=args.checksum,
+                                  path_filter=_path_filter(args), progress=ProgressLine() if args.progress else None)
+            if args.incremental:
+                print("{} file(s) written ({} bytes), {} unchanged ({} bytes avoided), {} removed".format(
+                    summary.written, summary.bytes_written, summary.skipped, summary.bytes_skipped, summary.removed
+                ))
         else:
-            extract_file(file, dest, args.force, quiet=args.quiet)
+            extract_file(file, dest, args.force, quiet=args.quiet, incremental=args.incremental, checksum=args.checksum)
+    if tracer is not None:
+        tracer.save(args.trace)
+
+
+def export(args):
+    with SquashFsImage.from_file(args.file, args.offset) as image:
+        file = image.select(args.path)
+        if file is None:
+            raise Exception("{} not found".format(args.path))
+        if args.output == '-':
+            output = getattr(sys.stdout, "buffer", sys.stdout)
+            export_tar(file, output, args.compression or '', _path_filter(args))
+            output.flush()
+        else:
+            with open(args.output, "wb") as output:
+                export_tar(file, output, args.compression or '', _path_filter(args))
+
+
+def diff(args):
+    with SquashFsImage.from_file(args.file, args.offset) as old, \
+            SquashFsImage.from_file(args.other, args.offset) as new:
+        a = old.select(args.path)
+        b = new.select(args.path)
+        if a is None and b is None:
+            raise Exception("{} not found".format(args.path))
+        if a is None or b is None:
+            print("{} {}".format('+' if a is None else '-', args.path))
+            sys.exit(1)
+        changes = diff_trees(a, b, _path_filter(args))
+    for change in changes:
+        print(change)
+    if changes:
+        sys.exit(1)
+
+
+def manifest(args):
+    with SquashFsImage.from_file(args.file, args.offset) as image:
+        file = image.select(args.path)
+        if file is None:
+            raise Exception("{} not found".format(args.path))
+        digests = hash_tree(file, args.algorithm, args.jobs, _path_filter(args))
+    # Paths are relative to PATH so the output can be checked with sha256sum -c and the like.
+    prefix = len(file.path.rstrip('/')) + 1
+    for path, digest in digests.items():
+        print("{}  {}".format(digest, path[prefix:] or file.name))
+
+
+def _print_buckets(title, buckets):
+    if title is not None:
+        print("{:30} {:>8} {:>14} {:>14} {:>6} {:>13} {:>7}".format(
+            title, "files", "bytes", "compressed", "ratio", "uncompressed", "sparse"
+        ))
+    for name, bucket in buckets.items():
+        print("{:30} {:>8} {:>14} {:>14} {:>6} {:>13} {:>7}".format(
+            name,
+            bucket["files"],
+            bucket["bytes"],
+            bucket["compressed_bytes"],
+            "-" if bucket["ratio"] is None else "{:.1%}".format(bucket["ratio"]),
+            "{}/{}".format(bucket["uncompressed_blocks"], bucket["blocks"]),
+            bucket["sparse_blocks"],
+        ))
+
+
+def stats(args):
+    with SquashFsImage.from_file(args.file, args.offset) as image:
+        file = image.select(args.path)
+        if file is None:
+            raise Exception("{} not found".format(args.path))
+        result = storage_stats(image, file, args.depth)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print("Compression: {}, block size: {}".format(result["compression"], result["block_size"]))
+    print()
+    _print_buckets("Directory", result["directories"])
+    _print_buckets(None, {"Total": result["total"]})
+    print()
+    extensions = result["extensions"]
+    _print_buckets("Extension", OrderedDict((name or "(none)", bucket) for name, bucket in extensions.items()))
+    print()
+    fragments = result["fragments"]
+    if fragments["blocks"]:
+        print("Fragments: {} block(s), {} bytes in {} compressed, {:.1%} full".format(
+            fragments["blocks"], fragments["bytes"], fragments["compressed_bytes"], fragments["packing_efficiency"]
+        ))
+    duplicates = result["duplicates"]
+    print("Duplicates: {} file(s), {} bytes saved".format(duplicates["files"], duplicates["bytes_saved"]))
+    print("Hard links: {}, {} bytes saved".format(result["hard_links"]["links"], result["hard_links"]["bytes_saved"]))
+    print("Metadata: " + ", ".join("{} {}".format(name, size) for name, size in result["metadata"].items()))
+
+
+def verify(args):
+    with SquashFsImage.from_file(args.file, args.offset) as image:
+        report = verify_image(image, args.jobs)
+    for problem in report.problems:
+        print(problem)
+        for path in problem.files:
+            print("  {}".format(path))
+    print("{} block(s) checked, {} problem(s) found".format(report.blocks, len(report.problems)))
+    if not report.ok:
+        sys.exit(1)
 
 
 def _dtfromts(timestamp, utc=False):
@@ -143,27 +316,110 @@ def main():
     pfile.add_argument("file", help="squashfs filesystem")
 
     poffset = argparse.ArgumentParser(add_help=False)
-    poffset.add_argument("-o", "--offset", type=int, default=0, help="absolute position of file system's start. Default: %(default)s")
+    poffset.add_argument("-o", "--offset", type=int, default=0,
+                         help="absolute position of file system's start. Default: %(default)s")
 
     ptz = argparse.ArgumentParser(add_help=False)
-    ptz.add_argument("--utc", action="store_true", help="use UTC rather than local time zone when displaying time. Default: %(default)s")
-    ptz.add_argument("--showtz", action="store_true", dest="show_tz", help="show UTC offset when displaying time. Default: %(default)s")
+    ptz.add_argument("--utc", action="store_true",
+                     help="use UTC rather than local time zone when displaying time. Default: %(default)s")
+    ptz.add_argument("--showtz", action="store_true", dest="show_tz",
+                     help="show UTC offset when displaying time. Default: %(default)s")
+
+    pfilter = argparse.ArgumentParser(add_help=False)
+    pfilter.add_argument("--include", action="append", metavar="PATTERN",
+                         help="only keep what matches this glob pattern, relative to PATH. Can be repeated")
+    pfilter.add_argument("--exclude", action="append", metavar="PATTERN",
+                         help="leave out what matches this glob pattern, relative to PATH. Can be repeated")
+    pfilter.add_argument("--include-from", action="append", metavar="FILE",
+                         help="read include patterns from FILE, one per line")
+    pfilter.add_argument("--exclude-from", action="append", metavar="FILE",
+                         help="read exclude patterns from FILE, one per line")
 
     helplist = "List the contents of the file system"
     parser_l = subparsers.add_parser("list", parents=[pfile, poffset, ptz], help=helplist.lower(), description=helplist)
-    parser_l.add_argument("-p", "--path", default=ROOT, help="absolute path of directory or file to list. Default: %(default)r")
-    parser_l.add_argument("-r", "--recursive", action="store_true", help="whether to list recursively. For the root directory the value is inverted. Default: %(default)s")
-    parser_l.add_argument("-t", "--type", nargs='+', metavar="TYPE", choices=list("fdlpsbc"), help="when listing a directory, filter by file type with %(choices)s")
+    parser_l.add_argument("-p", "--path", default=ROOT,
+                          help="absolute path of directory or file to list. Default: %(default)r")
+    parser_l.add_argument("-r", "--recursive", action="store_true",
+                          help="whether to list recursively. For the root directory the value is inverted. "
+                               "Default: %(default)s")
+    parser_l.add_argument("-t", "--type", nargs='+', metavar="TYPE", choices=list("fdlpsbc"),
+                          help="when listing a directory, filter by file type with %(choices)s")
     parser_l.set_defaults(func=list_)
 
     helpextr = "Extract files from the file system"
-    parser_e = subparsers.add_parser("extract", parents=[pfile, poffset], help=helpextr.lower(), description=helpextr)
-    parser_e.add_argument("-d", "--dest", help="directory that will contain the extracted file(s). If it doesn't exist it will be created. Default: current directory")
-    parser_e.add_argument("-p", "--path", default=ROOT, help="absolute path of directory or file to extract. Default: %(default)r")
-    parser_e.add_argument("-f", "--force", action="store_true", help="overwrite files that already exist. Default: %(default)s")
-    parser_e.add_argument("-q", "--quiet", action="store_true", help="don't print extraction status. Default: %(default)s")
+    parser_e = subparsers.add_parser("extract", parents=[pfile, poffset, pfilter],
+                                     help=helpextr.lower(), description=helpextr)
+    parser_e.add_argument("-d", "--dest",
+                          help="directory that will contain the extracted file(s). If it doesn't exist it will be "
+                               "created. Default: current directory")
+    parser_e.add_argument("-p", "--path", default=ROOT,
+                          help="absolute path of directory or file to extract. Default: %(default)r")
+    parser_e.add_argument("-f", "--force", action="store_true",
+                          help="overwrite files that already exist. Default: %(default)s")
+    parser_e.add_argument("-q", "--quiet", action="store_true",
+                          help="don't print extraction status. Default: %(default)s")
+    parser_e.add_argument("-P", "--progress", action="store_true",
+                          help="show a progress line rather than each extracted file. Default: %(default)s")
+    parser_e.add_argument("-i", "--incremental", action="store_true",
+                          help="only rewrite files that changed and remove files that are not in the image. "
+                               "Default: %(default)s")
+    parser_e.add_argument("--checksum", action="store_true",
+                          help="in incremental mode, also compare the SHA-256 of the files. Default: %(default)s")
+    parser_e.add_argument("-j", "--jobs", type=int, default=1,
+                          help="number of files to extract concurrently. Default: %(default)s")
+    parser_e.add_argument("--trace", metavar="FILE",
+                          help="write a timeline of opening the image and extracting to FILE, in the Chrome trace "
+                               "event format")
     parser_e.set_defaults(func=extract)
 
+    helpexport = "Write files from the file system to an archive without extracting them"
+    parser_x = subparsers.add_parser("export", parents=[pfile, poffset, pfilter],
+                                     help=helpexport.lower(), description=helpexport)
+    parser_x.add_argument("-p", "--path", default=ROOT,
+                          help="absolute path of directory or file to export. Default: %(default)r")
+    parser_x.add_argument("--format", default="tar", choices=["tar"], help="archive format. Default: %(default)s")
+    parser_x.add_argument("-c", "--compression", choices=["gz", "bz2", "xz"],
+                          help="compress the archive with %(choices)s")
+    parser_x.add_argument("-O", "--output", default='-',
+                          help="archive to write, '-' meaning standard output. Default: %(default)r")
+    parser_x.set_defaults(func=export)
+
+    helpdiff = "Compare two file systems"
+    parser_d = subparsers.add_parser("diff", parents=[pfile, pfilter], help=helpdiff.lower(), description=helpdiff)
+    parser_d.add_argument("other", help="squashfs filesystem to compare with the first one")
+    parser_d.add_argument("-o", "--offset", type=int, default=0,
+                          help="absolute position of the file systems' start in both files. Default: %(default)s")
+    parser_d.add_argument("-p", "--path", default=ROOT,
+                          help="absolute path of directory or file to compare. Default: %(default)r")
+    parser_d.set_defaults(func=diff)
+
+    helpmanifest = "Print the digest of every regular file"
+    parser_m = subparsers.add_parser("manifest", parents=[pfile, poffset, pfilter],
+                                     help=helpmanifest.lower(), description=helpmanifest)
+    parser_m.add_argument("-p", "--path", default=ROOT,
+                          help="absolute path of directory or file to hash. Default: %(default)r")
+    parser_m.add_argument("-a", "--algorithm", default="sha256",
+                          help="any algorithm supported by hashlib. Default: %(default)s")
+    parser_m.add_argument("-j", "--jobs", type=int, default=1,
+                          help="number of files to hash concurrently. Default: %(default)s")
+    parser_m.set_defaults(func=manifest)
+
+    helpstats = "Show how the files are stored, without decompressing them"
+    parser_st = subparsers.add_parser("stats", parents=[pfile, poffset], help=helpstats.lower(), description=helpstats)
+    parser_st.add_argument("-p", "--path", default=ROOT,
+                           help="absolute path of directory or file to analyze. Default: %(default)r")
+    parser_st.add_argument("-d", "--depth", type=int, default=1,
+                           help="group sizes by directory down to this depth below PATH. Default: %(default)s")
+    parser_st.add_argument("--json", action="store_true", help="print the statistics as JSON. Default: %(default)s")
+    parser_st.set_defaults(func=stats)
+
+    helpverify = "Check that all the blocks of the file system can be decompressed"
+    parser_v = subparsers.add_parser("verify", parents=[pfile, poffset],
+                                     help=helpverify.lower(), description=helpverify)
+    parser_v.add_argument("-j", "--jobs", type=int, default=1,
+                          help="number of blocks to check concurrently. Default: %(default)s")
+    parser_v.set_defaults(func=verify)
+
     helpscan = "Find and show all the superblocks that can be found in a file"
     parser_s = subparsers.add_parser("scan", parents=[pfile, ptz], help=helpscan.lower(), description=helpscan)
     parser_s.set_defaults(func=scan)
@@ -171,12 +427,14 @@ def main():
     args = parser.parse_args()
     if "file" not in args:
         parser.error("the following arguments are required: subcommand")
-    if not os.path.isfile(args.file):
+    if not os.path.isfile(args.file) or ("other" in args and not os.path.isfile(args.other)):
         sys.exit("error: file does not exist")
     if "path" in args and not posixpath.isabs(args.path):
         sys.exit("error: path is not absolute")
     if "offset" in args and args.offset is not None and args.offset < 0:
         sys.exit("error: offset cannot be negative")
+    if "jobs" in args and args.jobs < 1:
+        sys.exit("error: jobs must be at least 1")
 
     try:
         args.func(args)
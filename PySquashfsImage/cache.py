@@ -0,0 +1,147 @@
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+
+_ids = itertools.count()
+
+
+class MemoryBudget(object):
+    """Limit on the bytes held by BlockCaches, those of several images possibly,
+    kept by evicting the least recently used blocks whatever cache they are in.
+
+    Pass the same instance to the images sharing it, see SquashFsImage.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit  # In bytes.
+        self._used = 0
+        # (cache id, key) -> size, least recently used first.
+        self._entries = OrderedDict()
+        # Cache id -> weak reference to the cache, so that images dropped without
+        # being closed don't stay alive and have their blocks released.
+        self._caches = {}
+        # Ids of the caches garbage collected, appended by the weak reference callbacks,
+        # which can run in any thread, holding the lock or not.
+        self._collected = []
+        # Shared by the caches using this budget, so that evicting from one
+        # while adding to another can't deadlock.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        with self._lock:
+            self._purge()
+            return "{}(limit={}, used={}, blocks={})".format(
+                self.__class__.__name__, self.limit, self._used, len(self._entries)
+            )
+
+    @property
+    def used(self):
+        """Bytes held by the caches."""
+        with self._lock:
+            self._purge()
+            return self._used
+
+    def _register(self, cache):
+        collected = self._collected
+        with self._lock:
+            self._caches[cache._id] = weakref.ref(cache, lambda _, id_=cache._id: collected.append(id_))
+
+    # The following methods are called with the lock held.
+
+    def _purge(self):
+        """Release the blocks of the caches garbage collected."""
+        while self._collected:
+            id_ = self._collected.pop()
+            del self._caches[id_]
+            for entry in [entry for entry in self._entries if entry[0] == id_]:
+                self._used -= self._entries.pop(entry)
+
+    def _touch(self, cache, key):
+        size = self._entries.pop((cache._id, key))
+        self._entries[cache._id, key] = size
+
+    def _charge(self, cache, key, size):
+        """Make room for a block of `size` bytes and account for it.
+        Return False if it can't fit at all.
+        """
+        if size > self.limit:
+            return False
+        self._purge()
+        while self._used + size > self.limit:
+            (id_, evicted_key), evicted_size = self._entries.popitem(last=False)
+            evicted_cache = self._caches[id_]()
+            if evicted_cache is not None:
+                evicted_cache._drop(evicted_key)
+            self._used -= evicted_size
+        self._entries[cache._id, key] = size
+        self._used += size
+        return True
+
+    def _release(self, cache, key):
+        self._used -= self._entries.pop((cache._id, key))
+
+
+class BlockCache(object):
+    """Thread-safe LRU cache of decompressed blocks, holding at most `maxsize`
+    of them (None for no limit) and sharing a MemoryBudget if given one.
+    """
+
+    def __init__(self, maxsize=256, budget=None, name=None):
+        self.name = name  # One of stats.CACHES for the caches of SquashFsImage.
+        self.maxsize = maxsize
+        self.nbytes = 0  # Size of the blocks held.
+        self._blocks = OrderedDict()  # Key -> (value, size)
+        self._budget = budget
+        self._lock = budget._lock if budget is not None else threading.Lock()
+        self._id = next(_ids)
+        if budget is not None:
+            budget._register(self)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, key):
+        """Return the value cached under `key`, marking it as recently used, or None."""
+        with self._lock:
+            entry = self._blocks.pop(key, None)
+            if entry is None:
+                return None
+            self._blocks[key] = entry  # OrderedDict.move_to_end() is Python 3 only.
+            if self._budget is not None:
+                self._budget._touch(self, key)
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """Cache `value`, a block or anything holding `size` bytes."""
+        size = len(value) if size is None else size
+        with self._lock:
+            if key in self._blocks:
+                self._remove(key)
+            if self._budget is not None and not self._budget._charge(self, key, size):
+                return
+            self._blocks[key] = value, size
+            self.nbytes += size
+            while self.maxsize is not None and len(self._blocks) > self.maxsize:
+                self._remove(next(iter(self._blocks)))
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._blocks):
+                self._remove(key)
+
+    def items(self):
+        """Return a list of the (key, value) pairs cached."""
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._blocks.items()]
+
+    def _remove(self, key):
+        _, size = self._blocks.pop(key)
+        self.nbytes -= size
+        if self._budget is not None:
+            self._budget._release(self, key)
+
+    def _drop(self, key):
+        """Forget `key`, evicted by the budget."""
+        _, size = self._blocks.pop(key)
+        self.nbytes -= size
@@ -1,3 +1,5 @@
+import threading
+
 from .const import Compression
 
 
@@ -90,10 +92,15 @@ class ZSTDCompressor(Compressor):
 
     def __init__(self):
         import zstandard
-        self._lib = zstandard.ZstdDecompressor()
+        self._lib = zstandard
+        # ZstdDecompressor objects aren't thread-safe, so each thread gets its own.
+        self._local = threading.local()
 
     def uncompress(self, src, size, outsize):
-        return self._lib.decompress(src)
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = self._lib.ZstdDecompressor()
+        return decompressor.decompress(src)
 
 
 compressors = {
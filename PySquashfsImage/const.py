@@ -26,6 +26,18 @@ SQUASHFS_USED_BLK = SQUASHFS_INVALID_BLK - 1  # -2
 SQUASHFS_COMPRESSED_BIT = 1 << 15
 SQUASHFS_COMPRESSED_BIT_BLOCK = 1 << 24
 
+SQUASHFS_XATTR_USER = 0
+SQUASHFS_XATTR_TRUSTED = 1
+SQUASHFS_XATTR_SECURITY = 2
+SQUASHFS_XATTR_VALUE_OOL = 256
+SQUASHFS_XATTR_PREFIX_MASK = 0xFF
+
+XATTR_PREFIXES = {
+    SQUASHFS_XATTR_USER: "user.",
+    SQUASHFS_XATTR_TRUSTED: "trusted.",
+    SQUASHFS_XATTR_SECURITY: "security.",
+}
+
 
 class Type(IntEnum):
     DIR = 1
@@ -0,0 +1,169 @@
+from .const import SQUASHFS_INVALID_FRAG
+from .macro import SQUASHFS_COMPRESSED_SIZE_BLOCK
+from .plan import kind
+
+
+class Change(object):
+    """A difference between two trees found by diff()."""
+
+    def __init__(self, path, status, fields=()):
+        self.path = path  # Absolute path, the compared directories being the root.
+        self.status = status  # "added", "removed" or "changed".
+        self.fields = list(fields)  # What changed: "type", "mode", "uid", "gid", "mtime", "content", ...
+
+    def __repr__(self):
+        return "{}({!r}, {!r}, {!r})".format(self.__class__.__name__, self.path, self.status, self.fields)
+
+    def __str__(self):
+        symbol = {"added": '+', "removed": '-', "changed": 'M'}[self.status]
+        if self.fields:
+            return "{} {} ({})".format(symbol, self.path, ", ".join(self.fields))
+        return "{} {}".format(symbol, self.path)
+
+
+def _block_list(file):
+    inode = file.inode
+    if not inode.blocks:
+        return []
+    blocks = file.image._read_block_list(inode.block_start, inode.block_offset, inode.blocks)
+    return [block for block in blocks if block != SQUASHFS_INVALID_FRAG]
+
+
+def _block_data(image, start, block, size):
+    return image._read_data_block(start, block) if block else b'\x00' * size
+
+
+class _Comparator(object):
+    """Compare the content of files from two images, from their compressed blocks when possible."""
+
+    def __init__(self, old, new):
+        self._old = old
+        self._new = new
+        # Raw comparisons only make sense if both images compress the same way.
+        self._raw = (
+            old.sblk.compression == new.sblk.compression and old.sblk.block_size == new.sblk.block_size
+        )
+        self._fragments = {}  # (old index, new index) -> whether the raw fragment blocks are equal.
+
+    def same(self, a, b):
+        if a.size != b.size:
+            return False
+        if not self._raw:
+            return self._same_stream(a.iter_bytes(), b.iter_bytes())
+        a_blocks, b_blocks = _block_list(a), _block_list(b)
+        if len(a_blocks) != len(b_blocks) or bool(a.inode.frag_bytes) != bool(b.inode.frag_bytes):
+            # The tail is a full block in one file and in a fragment in the other,
+            # as when one image was built with -no-fragments.
+            return self._same_stream(a.iter_bytes(), b.iter_bytes())
+        block_size = self._old.sblk.block_size
+        a_start, b_start = a.inode.start, b.inode.start
+        for i, (a_block, b_block) in enumerate(zip(a_blocks, b_blocks)):
+            size = min(block_size, a.size - i * block_size)
+            if not self._same_block(a_start, a_block, b_start, b_block, size):
+                return False
+            a_start += SQUASHFS_COMPRESSED_SIZE_BLOCK(a_block)
+            b_start += SQUASHFS_COMPRESSED_SIZE_BLOCK(b_block)
+        return self._same_tail(a, b)
+
+    def _same_block(self, a_start, a_block, b_start, b_block, size):
+        if a_block == b_block:
+            if not a_block:
+                return True
+            c_size = SQUASHFS_COMPRESSED_SIZE_BLOCK(a_block)
+            if self._old._read(a_start, c_size) == self._new._read(b_start, c_size):
+                return True
+        # Different compressed data may still decompress to the same bytes.
+        return _block_data(self._old, a_start, a_block, size) == _block_data(self._new, b_start, b_block, size)
+
+    def _same_tail(self, a, b):
+        a_inode, b_inode = a.inode, b.inode
+        if not a_inode.frag_bytes or not b_inode.frag_bytes:
+            return a_inode.frag_bytes == b_inode.frag_bytes
+        a_start, a_size = self._old._read_fragment(a_inode.fragment)
+        b_start, b_size = self._new._read_fragment(b_inode.fragment)
+        if a_inode.offset == b_inode.offset:
+            key = (a_inode.fragment, b_inode.fragment)
+            if key not in self._fragments:
+                c_size = SQUASHFS_COMPRESSED_SIZE_BLOCK(a_size)
+                self._fragments[key] = a_size == b_size and (
+                    self._old._read(a_start, c_size) == self._new._read(b_start, c_size)
+                )
+            if self._fragments[key]:
+                return True
+        a_data = self._old._read_data_block(a_start, a_size)
+        b_data = self._new._read_data_block(b_start, b_size)
+        return (
+            a_data[a_inode.offset : a_inode.offset + a_inode.frag_bytes]
+            == b_data[b_inode.offset : b_inode.offset + b_inode.frag_bytes]
+        )
+
+    @staticmethod
+    def _same_stream(a, b):
+        a_buffer = b_buffer = b''
+        for a_block in a:
+            a_buffer += a_block
+            while len(b_buffer) < len(a_buffer):
+                b_buffer += next(b)
+            size = len(a_buffer)
+            if a_buffer != b_buffer[:size]:
+                return False
+            a_buffer, b_buffer = b'', b_buffer[size:]
+        return True
+
+
+def _changed_fields(a, b, comparator):
+    if kind(a) != kind(b):
+        return ["type"]
+    fields = []
+    if a.mode != b.mode:
+        fields.append("mode")
+    if a.uid != b.uid:
+        fields.append("uid")
+    if a.gid != b.gid:
+        fields.append("gid")
+    if a.time != b.time:
+        fields.append("mtime")
+    if a.xattrs != b.xattrs:
+        fields.append("xattrs")
+    if a.is_file and not comparator.same(a, b):
+        fields.append("content")
+    elif a.is_symlink and a.readlink() != b.readlink():
+        fields.append("target")
+    elif (a.is_block_device or a.is_char_device) and a.size != b.size:
+        fields.append("device")
+    return fields
+
+
+def diff(old, new, path_filter=None):
+    """Compare the tree at `old` with the tree at `new`, two files or directories,
+    usually from different images, and return the list of Changes sorted by path.
+
+    Regular files of the same size are compared block by block. When both images
+    use the same compressor and block size, blocks are first compared compressed
+    and only decompressed if that is inconclusive. Added and removed directories
+    are reported without their content. `path_filter` is an optional filters.PathFilter.
+    """
+    comparator = _Comparator(old.image, new.image)
+    changes = []
+    stack = [(old, new, ())]
+    while stack:
+        a, b, parts = stack.pop()
+        fields = _changed_fields(a, b, comparator)
+        if fields:
+            changes.append(Change('/' + '/'.join(parts), "changed", fields))
+        if not a.is_dir or not b.is_dir:
+            continue
+        for name in set(a.children) | set(b.children):
+            child = parts + (name,)
+            if path_filter is not None:
+                entry = a.children[name] if name in a.children else b.children[name]
+                if not (path_filter.traverses(child) if entry.is_dir else path_filter.matches(child)):
+                    continue
+            if name not in b.children:
+                changes.append(Change('/' + '/'.join(child), "removed"))
+            elif name not in a.children:
+                changes.append(Change('/' + '/'.join(child), "added"))
+            else:
+                stack.append((a.children[name], b.children[name], child))
+    changes.sort(key=lambda change: change.path)
+    return changes
@@ -0,0 +1,103 @@
+import posixpath
+import tarfile
+from stat import S_IMODE
+
+from .util import DECODE_ERRORS
+
+
+class _Reader(object):
+    """File-like object reading from an iterator of byte strings,
+    only keeping in memory the current block and the position in it.
+    """
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._block = b''
+        self._offset = 0
+
+    def read(self, size=-1):
+        # Only the bytes returned are copied, tarfile reads blocks in small pieces.
+        chunks = []
+        while size:
+            if self._offset == len(self._block):
+                self._block = next(self._blocks, None)
+                self._offset = 0
+                if self._block is None:
+                    self._block = b''
+                    break
+                continue
+            end = len(self._block) if size < 0 else min(len(self._block), self._offset + size)
+            chunks.append(self._block[self._offset : end] if self._offset or end < len(self._block) else self._block)
+            if size > 0:
+                size -= end - self._offset
+            self._offset = end
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+
+def _tarinfo(file, name):
+    info = tarfile.TarInfo(name)
+    info.mode = S_IMODE(file.mode)
+    info.uid = file.uid
+    info.gid = file.gid
+    info.mtime = file.time
+    if file.is_dir:
+        info.type = tarfile.DIRTYPE
+    elif file.is_file:
+        info.type = tarfile.REGTYPE
+        info.size = file.size
+    elif file.is_symlink:
+        info.type = tarfile.SYMTYPE
+        info.linkname = file.readlink()
+    elif file.is_char_device or file.is_block_device:
+        info.type = tarfile.CHRTYPE if file.is_char_device else tarfile.BLKTYPE
+        info.devmajor = file.major
+        info.devminor = file.minor
+    elif file.is_fifo:
+        info.type = tarfile.FIFOTYPE
+    else:
+        # Sockets can't be archived.
+        return None
+    for key, value in file.xattrs.items():
+        # Non UTF-8 values are written as is with the 'BINARY' header charset.
+        info.pax_headers["SCHILY.xattr." + key] = value.decode("utf-8", DECODE_ERRORS)
+    return info
+
+
+def export_tar(file, fileobj, compression='', path_filter=None, arcname=None):
+    """Write `file` and, if it is a directory, its subtree as a tar archive to `fileobj`.
+
+    The archive is streamed: `fileobj` only needs a write() method, so it may be
+    a pipe, a socket or sys.stdout.buffer, and at most one data block of a file
+    is held in memory. `compression` can be '', 'gz', 'bz2' or 'xz'.
+    Entries are named relative to `arcname`, which defaults to the name of `file`,
+    '.' being the name of the root directory. Hard links, symlinks, devices,
+    FIFOs, ownership and extended attributes are preserved, sockets are skipped.
+    `path_filter` is an optional filters.PathFilter for directories.
+    """
+    if arcname is None:
+        arcname = file.name or '.'
+    if file.is_dir and path_filter is not None:
+        files = path_filter.walk(file)
+    elif file.is_dir:
+        files = file.riter()
+    else:
+        files = [file]
+    prefix = len(file.path.rstrip('/')) + 1
+    links = {}
+    with tarfile.open(fileobj=fileobj, mode="w|" + compression, format=tarfile.PAX_FORMAT,
+                      encoding="utf-8") as tar:
+        for f in files:
+            name = posixpath.normpath(posixpath.join(arcname, f.path[prefix:]))
+            info = _tarinfo(f, name)
+            if info is None:
+                continue
+            if not f.is_dir and f.inode.nlink > 1:
+                link = links.get(f.inode.inode_number)
+                if link is not None:
+                    info.type = tarfile.LNKTYPE
+                    info.linkname = link
+                    info.size = 0
+                    tar.addfile(info)
+                    continue
+                links[f.inode.inode_number] = name
+            tar.addfile(info, _Reader(f.iter_bytes()) if f.is_file else None)
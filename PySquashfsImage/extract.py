@@ -1,15 +1,27 @@
 from __future__ import print_function
 
+import hashlib
 import os
+import shutil
 import sys
+import threading
+from collections import OrderedDict
 from contextlib import contextmanager
-from errno import EEXIST, ENOENT, EPERM
-from stat import S_IFBLK, S_IFCHR, S_IFIFO, S_IFSOCK, S_IWUSR
+from errno import EEXIST, EFBIG, EINVAL, ENOENT, ENOSPC, ENOSYS, ENOTSOCK, EPERM, EXDEV
+from functools import partial
+from stat import S_IFBLK, S_IFCHR, S_IFIFO, S_IFMT, S_IFSOCK, S_IMODE, S_ISDIR, S_IWUSR
 
 from .file import FIFO, BlockDevice, CharacterDevice, RegularFile, Socket, Symlink
 from .macro import LOOKUP_INDEX, LOOKUP_OFFSET
+from .stats import clock
+from .tracing import span
 from .xattr import has_xattrs, write_xattr
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 try:
     from os import geteuid
 except ImportError:
@@ -22,10 +34,22 @@ try:
 except ImportError:
     supports_follow_symlinks = set()
 
+try:
+    # Whether entries can be created relative to an open directory and
+    # attributes set through open file descriptors rather than paths, which
+    # needs every function used on these paths to support it. Functions
+    # missing from the platform are None, which is in neither set.
+    _supports_dir_fd = all(getattr(os, name, None) in os.supports_dir_fd for name in (
+        "open", "mkdir", "stat", "unlink", "utime", "chmod", "chown", "mknod", "symlink", "readlink", "link"
+    ))
+    _supports_fd = all(getattr(os, name, None) in os.supports_fd for name in ("utime", "chmod", "chown", "listdir"))
+except AttributeError:
+    _supports_dir_fd = _supports_fd = False
+
 try:
     from os import chown
 except ImportError:
-    def chown(path, uid, gid):
+    def chown(path, uid, gid, **kwargs):
         pass
 
 try:
@@ -34,6 +58,65 @@ except ImportError:
     def lchown(path, uid, gid):
         pass
 
+try:
+    from os import copy_file_range
+except ImportError:
+    copy_file_range = None
+
+try:
+    from os import sendfile
+except ImportError:
+    sendfile = None
+
+try:
+    from errno import EOPNOTSUPP
+except ImportError:
+    EOPNOTSUPP = EINVAL
+
+
+def _libc_fallocate():
+    """Return a function calling fallocate(2) through the C library on Linux, or None.
+
+    glibc's posix_fallocate() emulates it on file systems that don't support it by writing
+    to every block, which would write the files twice, whereas fallocate(2) fails there.
+    """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        function = getattr(libc, "fallocate64", None) or libc.fallocate
+    except (ImportError, OSError, AttributeError):
+        return None
+    function.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    function.restype = ctypes.c_int
+
+    def fallocate(fd, offset, size):
+        if function(fd, 0, offset, size):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+    return fallocate
+
+
+if sys.platform.startswith("linux"):
+    _fallocate = _libc_fallocate()
+else:
+    # Elsewhere posix_fallocate() is implemented by the kernel, when available.
+    _fallocate = getattr(os, "posix_fallocate", None)
+
+try:
+    from os import writev
+except ImportError:
+    writev = None
+
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 16
+if _IOV_MAX <= 0:
+    _IOV_MAX = 16
+
+# Decompressed blocks are gathered until they reach this size before being written.
+_WRITE_BATCH = 1 << 20
+
 try:
     from os import makedev
 except ImportError:
@@ -43,99 +126,480 @@ except ImportError:
 try:
     from os import mknod
 except ImportError:
-    def mknod(path, mode=0o600, device=0):
+    def mknod(path, mode=0o600, device=0, **kwargs):
         pass
 
+_O_DIRECTORY = getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_NOFOLLOW", 0)
+
 
-def set_attributes(pathname, file, set_mode):
+def _target(pathname, dir_fd=None, fd=None):
+    """Return the path argument and the keyword arguments of an os function
+    operating on `pathname`, preferring its open file descriptor `fd`,
+    then its name in the directory open as `dir_fd`, then `pathname` itself.
+    """
+    if fd is not None:
+        return fd, {}
+    if dir_fd is not None:
+        return os.path.basename(pathname), {"dir_fd": dir_fd}
+    return pathname, {}
+
+
+def set_attributes(pathname, file, set_mode, dir_fd=None, fd=None):
+    """Set the time, owner, extended attributes and mode of `pathname` from `file`.
+
+    `dir_fd` and `fd` avoid resolving `pathname` again: the first one is a file
+    descriptor of the directory containing it, the second one of `pathname` itself.
+    """
     # unsquashfs.c
-    os.utime(pathname, (file.time, file.time))
+    target, kwargs = _target(pathname, dir_fd, fd)
+    os.utime(target, (file.time, file.time), **kwargs)
     mode = file.mode
     if _root:
-        chown(pathname, file.uid, file.gid)
+        chown(target, file.uid, file.gid, **kwargs)
     else:
         mode &= ~0o6000
-    write_xattr(pathname, file)
+    write_xattr(pathname, file, fd)
     if set_mode or (mode & 0o7000):
         try:
-            os.chmod(pathname, mode)
+            os.chmod(target, mode, **kwargs)
         except (IOError, OSError) as e:
             if _root or e.errno != EPERM or not (mode & 0o1000):
                 raise
             else:
-                os.chmod(pathname, mode & ~0o1000)
+                os.chmod(target, mode & ~0o1000, **kwargs)
 
 
-def _write_file(file, pathname):
-    mode = file.mode
-    if not _root and not (mode & S_IWUSR) and has_xattrs(file):
-        mode |= S_IWUSR
-    flags = os.O_CREAT | os.O_WRONLY
-    if sys.platform == "win32":
-        flags |= os.O_BINARY
-    fd = os.open(pathname, flags, mode & 0o777)  # Use os.open() because umask
+def _copy_range(src, dst, offset, count):
+    """Copy `count` bytes at `offset` in the file descriptor `src` to `dst`,
+    using the fastest method the platform and file systems support.
+    """
+    while count:
+        copied = None
+        for method in (copy_file_range, _sendfile):
+            if method is None:
+                continue
+            try:
+                copied = method(src, dst, count, offset)
+                break
+            except (IOError, OSError) as e:
+                if e.errno not in (EINVAL, ENOSYS, ENOTSOCK, EOPNOTSUPP, EXDEV):
+                    raise
+        if not copied:
+            # Some file systems, and some kernels across file systems,
+            # return 0 rather than an error from copy_file_range().
+            copied = os.write(dst, os.pread(src, count, offset))
+        if not copied:
+            raise IOError("unexpected end of file while copying data")
+        offset += copied
+        count -= copied
+
+
+if sendfile is not None:
+    def _sendfile(src, dst, count, offset):
+        return sendfile(dst, src, offset, count)
+else:
+    _sendfile = None
+
+
+def _write_all(fd, buffers):
+    """Write the byte strings `buffers` to `fd` with as few system calls as possible.
+    Short writes are resumed where they stopped.
+    """
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    while buffers:
+        if writev is not None:
+            written = writev(fd, buffers[:_IOV_MAX])
+        else:
+            written = os.write(fd, buffers[0])
+        if not written:
+            raise IOError("unable to write data")
+        # Drop what was written, keeping the rest of a partially written buffer.
+        count = 0
+        while count < len(buffers) and written >= len(buffers[count]):
+            written -= len(buffers[count])
+            count += 1
+        del buffers[:count]
+        if written:
+            buffers[0] = buffers[0][written:]
+
+
+def _preallocate(fd, offset, size):
+    """Reserve `size` bytes at `offset` in the file open as `fd` so its data can be allocated contiguously."""
+    if _fallocate is None or not size:
+        return
     try:
-        for block in file.iter_bytes():
-            os.write(fd, block)
-    finally:
-        os.close(fd)
+        _fallocate(fd, offset, size)
+    except (IOError, OSError) as e:
+        # The file system doesn't support it or there isn't enough room for all the data at once,
+        # writing will tell.
+        if e.errno not in (EINVAL, ENOSYS, EOPNOTSUPP, ENOSPC, EFBIG):
+            raise
+
+
+def _write_file(file, fd):
+    image = file.image
+    inode = file.inode
+    # The block list is decoded once for preallocating and reading.
+    block_list = image._read_block_list(inode.block_start, inode.block_offset, inode.blocks) if inode.blocks else []
+    # Only the data is preallocated, holes are left unallocated by seeking over them.
+    for offset, size, hole in image._iter_ranges(inode, block_list):
+        if not hole:
+            _preallocate(fd, offset, size)
+    src = image._fileno() if copy_file_range or sendfile else None
+    # Uncompressed blocks are copied by the kernel when possible.
+    blocks = image._iter_file(inode, raw=src is not None, sparse=True, block_list=block_list)
+    sparse = False
+    batch = []
+    size = 0
+    for block in blocks:
+        if isinstance(block, (tuple, int)):
+            _write_all(fd, batch)
+            batch, size = [], 0
+            if isinstance(block, tuple):
+                _copy_range(src, fd, *block)
+                # The kernel reads from the underlying file, whose offset isn't the image's.
+                image._count(read=block[1], start=block[0] - image._offset)
+            else:
+                os.lseek(fd, block, os.SEEK_CUR)
+                sparse = True
+            continue
+        batch.append(block)
+        size += len(block)
+        if size >= _WRITE_BATCH or len(batch) >= _IOV_MAX:
+            _write_all(fd, batch)
+            batch, size = [], 0
+    _write_all(fd, batch)
+    if sparse:
+        # The file might end with a hole.
+        os.ftruncate(fd, file.size)
+
+
+# The umask is process-wide: only the first of nested or concurrent
+# appropriate_umask() blocks sets it and the last one restores it.
+_umask_lock = threading.Lock()
+_umask_users = 0
+_umask_saved = None
 
 
 @contextmanager
 def appropriate_umask():
+    global _umask_users, _umask_saved
     if not _root:
         yield
         return
-    old = os.umask(0)
+    with _umask_lock:
+        if not _umask_users:
+            _umask_saved = os.umask(0)
+        _umask_users += 1
     try:
         yield
     finally:
-        os.umask(old)
+        with _umask_lock:
+            _umask_users -= 1
+            if not _umask_users:
+                os.umask(_umask_saved)
 
 
-def unlink(path):
+def unlink(path, dir_fd=None):
     try:
-        os.unlink(path)
+        target, kwargs = _target(path, dir_fd)
+        os.unlink(target, **kwargs)
     except Exception:
         pass
 
 
-def write_file(file, pathname, force=False):
+def write_file(file, pathname, force=False, dir_fd=None):
     # unsquashfs.c -> write_file
+    mode = file.mode
+    set_ = not _root and not (mode & S_IWUSR) and has_xattrs(file)
+    if set_:
+        mode |= S_IWUSR
+    flags = os.O_CREAT | os.O_WRONLY | os.O_EXCL
+    if sys.platform == "win32":
+        flags |= os.O_BINARY
+    target, kwargs = _target(pathname, dir_fd)
+    with appropriate_umask():
+        try:
+            fd = os.open(target, flags, mode & 0o777, **kwargs)  # Use os.open() because umask
+        except (IOError, OSError) as e:  # Should be FileExistsError (Python 2 compatibility)
+            if e.errno != EEXIST:
+                raise
+            if not force:
+                if sys.version_info >= (3, 3):
+                    raise FileExistsError("file already exists")
+                raise OSError("file already exists")
+            os.unlink(target, **kwargs)  # Don't ignore errors here.
+            fd = os.open(target, flags, mode & 0o777, **kwargs)
     try:
-        os.lstat(pathname)
-    except (IOError, OSError) as e:  # Should be FileNotFoundError (Python 2 compatibility)
+        tracer = file.image.tracer
+        with span(tracer, "write_file", {"path": file.path, "size": file.size} if tracer is not None else None):
+            _write_file(file, fd)
+        if _supports_fd:
+            set_attributes(pathname, file, force or set_, fd=fd)
+    finally:
+        os.close(fd)
+    if not _supports_fd:
+        set_attributes(pathname, file, force or set_, dir_fd)
+
+
+class _DirFds(object):
+    """File descriptors of the directories being extracted, so that their
+    entries are created without resolving the full path each time.
+
+    Descriptors are opened on demand and at most `size` unused ones are kept.
+    """
+
+    def __init__(self, size=64):
+        self._size = size
+        self._lock = threading.Lock()
+        self._fds = OrderedDict()  # path -> [fd, number of users]
+
+    def acquire(self, path):
+        with self._lock:
+            entry = self._fds.pop(path, None)
+            if entry is not None:
+                entry[1] += 1
+                self._fds[path] = entry
+                return entry[0]
+        fd = os.open(path, os.O_RDONLY | _O_DIRECTORY)
+        with self._lock:
+            entry = self._fds.get(path)
+            if entry is None:
+                self._fds[path] = [fd, 1]
+                self._evict()
+                return fd
+            entry[1] += 1
+        os.close(fd)  # Another thread opened it meanwhile.
+        return entry[0]
+
+    def release(self, path):
+        with self._lock:
+            self._fds[path][1] -= 1
+            self._evict()
+
+    def _evict(self):
+        unused = [path for path, (_, users) in self._fds.items() if not users]
+        for path in unused[: max(0, len(unused) - self._size)]:
+            os.close(self._fds.pop(path)[0])
+
+    def close(self):
+        with self._lock:
+            while self._fds:
+                os.close(self._fds.popitem()[1][0])
+
+    @contextmanager
+    def open(self, path):
+        """Context manager returning the file descriptor of the directory `path`,
+        or None if `path` is None.
+        """
+        if path is None:
+            yield None
+            return
+        fd = self.acquire(path)
+        try:
+            yield fd
+        finally:
+            self.release(path)
+
+
+@contextmanager
+def _no_dir_fd(path):
+    yield None
+
+
+class LookupTable(object):
+    """Paths of the extracted files that have several hard links, by inode number.
+
+    Paths are kept in `paths` if given, a dictionary in the format earlier versions
+    took as lookup tables: paths by LOOKUP_INDEX() then LOOKUP_OFFSET() of the inode
+    number minus 1. Files with a single link are never recorded. Which inodes have
+    already been claimed for extraction is kept in a bitmap sized from `inodes`,
+    allocated when first needed and grown for images with more inodes.
+    """
+
+    def __init__(self, inodes, paths=None):
+        self._inodes = inodes
+        self._claimed = None
+        self._paths = {} if paths is None else paths
+        self._lock = threading.Lock()
+
+    def claim(self, number):
+        """Return True the first time it is called for the inode `number`,
+        False afterwards or if a path is already recorded for it.
+        """
+        index, bit = number >> 3, 1 << (number & 7)
+        with self._lock:
+            if self._claimed is None:
+                self._claimed = bytearray((max(self._inodes, number) >> 3) + 1)
+            elif index >= len(self._claimed):
+                self._claimed.extend(bytearray(index + 1 - len(self._claimed)))
+            if self._claimed[index] & bit or self.get(number) is not None:
+                return False
+            self._claimed[index] |= bit
+            return True
+
+    def get(self, number):
+        paths = self._paths.get(LOOKUP_INDEX(number - 1))
+        return paths.get(LOOKUP_OFFSET(number - 1)) if paths is not None else None
+
+    def insert(self, number, pathname):
+        self._paths.setdefault(LOOKUP_INDEX(number - 1), {})[LOOKUP_OFFSET(number - 1)] = pathname
+
+
+def _lookup_table(lookup_table, image):
+    """Return `lookup_table` as a LookupTable for `image`, wrapping it if it is
+    a dictionary and creating one if it is None.
+    """
+    if isinstance(lookup_table, LookupTable):
+        return lookup_table
+    if lookup_table is not None and not all(isinstance(paths, dict) for paths in lookup_table.values()):
+        raise ValueError("lookup_table must map LOOKUP_INDEX() values to dictionaries of paths")
+    return LookupTable(image.sblk.inodes, lookup_table)
+
+
+class Summary(object):
+    """What an extraction did to the destination."""
+
+    def __init__(self):
+        self.written = 0  # Number of files created or rewritten.
+        self.skipped = 0  # Number of files that were already up to date.
+        self.removed = 0  # Number of files removed because they are not in the image.
+        self.bytes_written = 0
+        self.bytes_skipped = 0
+
+    def __repr__(self):
+        return "{}(written={}, skipped={}, removed={}, bytes_written={}, bytes_skipped={})".format(
+            self.__class__.__name__, self.written, self.skipped, self.removed, self.bytes_written, self.bytes_skipped
+        )
+
+    def add(self, written, size=0):
+        if written:
+            self.written += 1
+            self.bytes_written += size
+        else:
+            self.skipped += 1
+            self.bytes_skipped += size
+
+
+class Progress(object):
+    """State of an extraction, passed to the `progress` callback of extract_dir().
+
+    Extraction goes through the "directories", "files", "links" and "attributes" phases.
+    The callback is called when a phase starts, after each file and once more with
+    `done` set to True at the end. Byte counts are totals since the extraction began,
+    read and decompressed bytes including those of other readers of the same image.
+    """
+
+    def __init__(self, image, callback, files_total=0):
+        self.phase = None
+        self.done = False
+        self.files = 0  # Number of files extracted or skipped.
+        self.files_total = files_total
+        self.bytes_read = 0  # Bytes read from the image.
+        self.bytes_decompressed = 0
+        self.bytes_written = 0
+        self.elapsed = OrderedDict()  # Seconds spent in each phase.
+        self._image = image
+        self._callback = callback
+        self._read = image._bytes_read
+        self._decompressed = image._bytes_decompressed
+        self._start = None
+
+    def __repr__(self):
+        return "{}(phase={!r}, files={}/{}, bytes_read={}, bytes_decompressed={}, bytes_written={})".format(
+            self.__class__.__name__, self.phase, self.files, self.files_total,
+            self.bytes_read, self.bytes_decompressed, self.bytes_written
+        )
+
+    def _update(self):
+        if self.phase is not None:
+            self.elapsed[self.phase] = clock() - self._start
+        self.bytes_read = self._image._bytes_read - self._read
+        self.bytes_decompressed = self._image._bytes_decompressed - self._decompressed
+        self._callback(self)
+
+    def enter(self, phase):
+        if self.phase is not None:
+            self.elapsed[self.phase] = clock() - self._start
+        self.phase = phase
+        self._start = clock()
+        self._update()
+
+    def add(self, size=0):
+        self.files += 1
+        self.bytes_written += size
+        self._update()
+
+    def finish(self):
+        self.done = True
+        self._update()
+
+
+def _lstat(pathname, dir_fd=None):
+    """Return the result of lstat() on `pathname` or None if it doesn't exist."""
+    target, kwargs = _target(pathname, dir_fd)
+    try:
+        if kwargs:
+            return os.stat(target, follow_symlinks=False, **kwargs)
+        return os.lstat(target)
+    except (IOError, OSError) as e:
         if e.errno != ENOENT:
             raise
+        return None
+
+
+def _remove(path, dir_fd=None):
+    """Remove whatever is at `path`, if anything, and return whether something was removed."""
+    st = _lstat(path, dir_fd)
+    if st is None:
+        return False
+    if S_ISDIR(st.st_mode):
+        shutil.rmtree(path)
     else:
-        if force:
-            os.unlink(pathname)  # Don't ignore errors here.
-        elif sys.version_info >= (3, 3):
-            raise FileExistsError("file already exists")
-        else:
-            raise OSError("file already exists")
-    with appropriate_umask():
-        _write_file(file, pathname)
-    set_ = not _root and not (file.mode & S_IWUSR) and has_xattrs(file)
-    set_attributes(pathname, file, force or set_)
+        target, kwargs = _target(path, dir_fd)
+        os.unlink(target, **kwargs)
+    return True
 
 
-def _lookup(lookup_table, number):
-    # unsquash-34.c
-    index = LOOKUP_INDEX(number - 1)
-    offset = LOOKUP_OFFSET(number - 1)
-    if lookup_table.get(index) is None:
-        return None
-    return lookup_table[index].get(offset)
+def _digest(chunks):
+    hash_ = hashlib.sha256()
+    for chunk in chunks:
+        hash_.update(chunk)
+    return hash_.digest()
 
 
-def _insert_lookup(lookup_table, number, pathname):
-    # unsquash-34.c
-    index = LOOKUP_INDEX(number - 1)
-    offset = LOOKUP_OFFSET(number - 1)
-    if lookup_table.get(index) is None:
-        lookup_table[index] = {}
-    lookup_table[index][offset] = pathname
+def _unchanged(file, pathname, checksum=False, link_path=None, dir_fd=None):
+    """Return whether `pathname` already holds `file`, comparing type, size,
+    modification time, permissions, owner (as root) and, if `checksum`
+    is true, the SHA-256 of the content.
+    """
+    st = _lstat(pathname, dir_fd)
+    if st is None:
+        return False
+    if link_path is not None:
+        try:
+            return os.path.samestat(st, os.lstat(link_path))
+        except (IOError, OSError):
+            return False
+    mode = file.mode if _root else file.mode & ~0o6000
+    if S_IFMT(st.st_mode) != S_IFMT(mode) or int(st.st_mtime) != file.time:
+        return False
+    if not file.is_symlink and S_IMODE(st.st_mode) != S_IMODE(mode):
+        return False
+    if _root and (st.st_uid, st.st_gid) != (file.uid, file.gid):
+        return False
+    if file.is_symlink:
+        target, kwargs = _target(pathname, dir_fd)
+        return os.readlink(target, **kwargs) == file.readlink()
+    if file.is_block_device or file.is_char_device:
+        return st.st_rdev == makedev(file.major, file.minor)
+    if file.is_file:
+        if st.st_size != file.size:
+            return False
+        if checksum:
+            with open(pathname, "rb") as f:
+                return _digest(iter(partial(f.read, 1024**2), b'')) == _digest(file.iter_bytes())
+    return True
 
 
 def _print(*args, **kwargs):
@@ -143,25 +607,46 @@ def _print(*args, **kwargs):
         print(*args, **kwargs)
 
 
-def extract_file(file, dest=None, force=False, lookup_table=None, quiet=True):
+def extract_file(file, dest=None, force=False, lookup_table=None, quiet=True, incremental=False, checksum=False,
+                 dir_fd=None):
+    """Extract `file` to `dest`.
+
+    In incremental mode, `dest` is left untouched if it already matches
+    `file` (see `checksum`), otherwise it is replaced whatever it is.
+    If given, `dir_fd` is a file descriptor of the directory containing
+    `dest`, relative to which it is created.
+    Return whether `dest` was written.
+    """
     # unsquashfs.c -> create_inode
     dest = dest if dest else os.path.basename(file.path)
+    linked = file.inode.nlink > 1
+    if linked:
+        lookup_table = _lookup_table(lookup_table, file.image)
+    link_path = lookup_table.get(file.inode.inode_number) if linked else None
+    if incremental:
+        if _unchanged(file, dest, checksum, link_path, dir_fd):
+            if linked and link_path is None:
+                lookup_table.insert(file.inode.inode_number, dest)
+            return False
+        _remove(dest, dir_fd)
+        force = True
     _print("extract {} to {}".format(file.path, dest), quiet=quiet)
-    lookup_table = lookup_table if lookup_table is not None else {}
-    link_path = _lookup(lookup_table, file.inode.inode_number)
+    target, kwargs = _target(dest, dir_fd)
     if link_path is not None:
         if force:
-            unlink(dest)
+            unlink(dest, dir_fd)
         if sys.version_info >= (3, 3) and os.link in supports_follow_symlinks:
-            os.link(link_path, dest, follow_symlinks=False)
-        return
+            if dir_fd is not None:
+                kwargs = {"dst_dir_fd": dir_fd}
+            os.link(link_path, target, follow_symlinks=False, **kwargs)
+        return True
     if isinstance(file, RegularFile):
-        write_file(file, dest, force)
+        write_file(file, dest, force, dir_fd)
     elif isinstance(file, Symlink):
         if force:
-            unlink(dest)
+            unlink(dest, dir_fd)
         try:
-            os.symlink(file.readlink(), dest)
+            os.symlink(file.readlink(), target, **kwargs)
         except (OSError, AttributeError) as e:
             # Windows + Python < 3.2 -> AttributeError
             # Windows + unprivileged user + Developer Mode disabled -> OSError
@@ -173,46 +658,184 @@ def extract_file(file, dest=None, force=False, lookup_table=None, quiet=True):
                 f.write(file.inode._symlink)
             os.utime(dest, (file.time, file.time))
         if sys.version_info >= (3, 3) and os.utime in supports_follow_symlinks:
-            os.utime(dest, (file.time, file.time), follow_symlinks=False)
+            os.utime(target, (file.time, file.time), follow_symlinks=False, **kwargs)
         if _root:
-            lchown(dest, file.uid, file.gid)
+            if kwargs:
+                chown(target, file.uid, file.gid, follow_symlinks=False, **kwargs)
+            else:
+                lchown(dest, file.uid, file.gid)
         write_xattr(dest, file)
     elif isinstance(file, (BlockDevice, CharacterDevice)):
         if _root:
             chrdev = isinstance(file, CharacterDevice)
             if force:
-                unlink(dest)
-            mknod(dest, S_IFCHR if chrdev else S_IFBLK, makedev(file.major, file.minor))
-            set_attributes(dest, file, True)
+                unlink(dest, dir_fd)
+            mknod(target, S_IFCHR if chrdev else S_IFBLK, makedev(file.major, file.minor), **kwargs)
+            set_attributes(dest, file, True, dir_fd)
         else:
             _print("WARNING: could not create block or character device because you are not root", quiet=quiet)
     elif isinstance(file, FIFO):
         if force:
-            unlink(dest)
-        mknod(dest, S_IFIFO, 0)
-        set_attributes(dest, file, True)
+            unlink(dest, dir_fd)
+        mknod(target, S_IFIFO, 0, **kwargs)
+        set_attributes(dest, file, True, dir_fd)
     elif isinstance(file, Socket):
-        mknod(dest, S_IFSOCK, 0)
-        set_attributes(dest, file, True)
+        mknod(target, S_IFSOCK, 0, **kwargs)
+        set_attributes(dest, file, True, dir_fd)
     else:
         raise Exception("unknown file type")
-    _insert_lookup(lookup_table, file.inode.inode_number, dest)
+    if linked:
+        lookup_table.insert(file.inode.inode_number, dest)
+    return True
+
+
+def _data_size(file):
+    return file.size if file.is_file else 0
+
 
+def _data_position(file):
+    if not file.is_file:
+        return 0, 0
+    return file.image._data_position(file.inode)
 
-def extract_dir(directory, dest="squashfs-root", force=False, lookup_table=None, quiet=True):
-    _print("extract {} to {}".format(directory.path, dest), quiet=quiet)
-    lookup_table = lookup_table if lookup_table is not None else {}
+
+def _make_dirs(directory, dest, force, quiet, incremental=False, summary=None, dir_fds=None, path_filter=None):
+    """Create the directory skeleton of `directory` under `dest`.
+
+    In incremental mode, whatever is in the way of a directory and
+    the entries not present in the image are removed.
+    Directories pruned by `path_filter` are not visited.
+
+    Return the list of (directory, path) pairs in creation order
+    and the list of (file, path, parent path) tuples that remain to be extracted.
+    """
+    opendir = dir_fds.open if dir_fds is not None else _no_dir_fd
+    directories = []
+    files = []
+    stack = [(directory, dest, None, ())]
+    while stack:
+        directory, dest, parent, parts = stack.pop()
+        _print("extract {} to {}".format(directory.path, dest), quiet=quiet)
+        with opendir(parent) as dir_fd:
+            st = _lstat(dest, dir_fd) if incremental else None
+            if st is not None and not S_ISDIR(st.st_mode) and _remove(dest, dir_fd) and summary is not None:
+                summary.removed += 1
+            target, kwargs = _target(dest, dir_fd)
+            try:
+                os.mkdir(target, 0o700, **kwargs)
+            except (IOError, OSError) as e:  # Should be FileExistsError (Python 2 compatibility)
+                if (force or incremental) and e.errno == EEXIST:
+                    os.chmod(target, 0o700, **kwargs)
+                else:
+                    raise
+        directories.append((directory, dest))
+        if incremental:
+            with opendir(dest) as dir_fd:
+                for name in os.listdir(dir_fd if dir_fd is not None and _supports_fd else dest):
+                    if name not in directory.children and _remove(os.path.join(dest, name), dir_fd):
+                        if summary is not None:
+                            summary.removed += 1
+        subdirs = []
+        for file in directory:
+            path = os.path.join(dest, file.name)
+            rel = parts + (file.name,)
+            if file.is_dir:
+                if path_filter is None or path_filter.traverses(rel):
+                    subdirs.append((file, path, dest, rel))
+            elif path_filter is None or path_filter.matches(rel):
+                files.append((file, path, dest))
+        stack.extend(reversed(subdirs))
+    return directories, files
+
+
+def extract_dir(directory, dest="squashfs-root", force=False, lookup_table=None, quiet=True, jobs=1,
+                incremental=False, checksum=False, path_filter=None, progress=None):
+    """Extract `directory` recursively to `dest`.
+
+    The directory tree is created first, then files are written,
+    using `jobs` threads if greater than 1, and finally the attributes
+    of the directories are set, deepest first. Where the platform allows it,
+    entries are created relative to open directory file descriptors.
+
+    In incremental mode, files that are already up to date are skipped
+    (see extract_file()) and files that are not in `directory` are removed.
+    A LookupTable, or a dictionary as LookupTable describes, can be shared
+    between calls for hard links to be preserved across them.
+    If a filters.PathFilter is given, only the files it selects are extracted,
+    without reading the others.
+    `progress` is an optional callable receiving a Progress as the extraction goes.
+    Return a Summary.
+    """
+    lookup_table = _lookup_table(lookup_table, directory.image)
+    summary = Summary()
+    state = Progress(directory.image, progress) if progress is not None else None
+    dir_fds = _DirFds() if _supports_dir_fd else None
+    opendir = dir_fds.open if dir_fds is not None else _no_dir_fd
+    tracer = directory.image.tracer
+    spans = []  # Tokens of the extract_dir span and of the current phase's.
+
+    def extract(file, path, parent):
+        with span(tracer, "extract_file", {"path": file.path} if tracer is not None else None):
+            with opendir(parent) as dir_fd:
+                return extract_file(file, path, force, lookup_table, quiet, incremental, checksum, dir_fd)
+
+    def done(written, size=0):
+        summary.add(written, size)
+        if state is not None:
+            state.add(size if written else 0)
+
+    def enter(phase):
+        if tracer is not None:
+            if len(spans) > 1:
+                tracer.end(spans.pop())
+            spans.append(tracer.start(phase, None))
+        if state is not None:
+            state.enter(phase)
+
+    if tracer is not None:
+        spans.append(tracer.start("extract_dir", {"path": directory.path, "dest": dest}))
     try:
-        os.mkdir(dest, 0o700)
-    except (IOError, OSError) as e:  # Should be FileExistsError (Python 2 compatibility)
-        if force and e.errno == EEXIST:
-            os.chmod(dest, 0o700)
-        else:
-            raise
-    for file in directory:
-        path = os.path.join(dest, os.path.relpath(file.path, directory.path))
-        if file.is_dir:
-            extract_dir(file, path, force, lookup_table, quiet)
+        enter("directories")
+        directories, files = _make_dirs(directory, dest, force, quiet, incremental, summary, dir_fds, path_filter)
+        # Hard links are created once every file they may point to has been written.
+        links = []
+        first = []
+        for item in files:
+            inode = item[0].inode
+            if inode.nlink > 1 and not lookup_table.claim(inode.inode_number):
+                links.append(item)
+            else:
+                first.append(item)
+        # Write files in the order their data is stored in the image.
+        first.sort(key=lambda item: _data_position(item[0]))
+        if state is not None:
+            state.files_total = len(files)
+        enter("files")
+        if jobs > 1 and ThreadPoolExecutor is not None:
+            # Most decompressors release the GIL, so threads are enough to use several cores.
+            # The umask is process-wide, set it once here so that write_file() leaves it as is.
+            with appropriate_umask(), ThreadPoolExecutor(jobs) as executor:
+                futures = [(item[0], executor.submit(extract, *item)) for item in first]
+                for file, future in futures:
+                    done(future.result(), _data_size(file))
         else:
-            extract_file(file, path, force, lookup_table, quiet)
-    set_attributes(dest, directory, True)
+            for item in first:
+                done(extract(*item), _data_size(item[0]))
+        enter("links")
+        for item in links:
+            done(extract(*item))
+        enter("attributes")
+        for directory, path in reversed(directories):
+            if _supports_fd and dir_fds is not None:
+                with opendir(path) as fd:
+                    set_attributes(path, directory, True, fd=fd)
+            else:
+                set_attributes(path, directory, True)
+        if state is not None:
+            state.finish()
+    finally:
+        if dir_fds is not None:
+            dir_fds.close()
+        while spans:
+            tracer.end(spans.pop())
+    return summary
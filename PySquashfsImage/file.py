@@ -1,8 +1,23 @@
 import posixpath
 import sys
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
-from .const import Type
+from .const import SQUASHFS_INVALID_XATTR, Type
+
+# A data block or fragment block as stored in the image.
+# - offset: position relative to the start of the image
+# - compressed_size: size in the image
+# - compressed: whether the block is compressed
+# - size: uncompressed size, None for fragment blocks as it isn't recorded
+# - fragment: whether this is a fragment block
+# - data: the bytes stored in the image, None unless asked for
+RawBlock = namedtuple("RawBlock", "offset compressed_size compressed size fragment data")
+
+# What a directory holds, see Directory.disk_usage().
+# - size: apparent size of the regular files
+# - compressed_size: size their data takes in the image, including their share of fragment blocks
+# - files: number of entries that aren't directories
+DiskUsage = namedtuple("DiskUsage", "size compressed_size files")
 
 
 class File(object):  # Python 2
@@ -86,8 +101,16 @@ class File(object):  # Python 2
 
     @property
     def xattr(self):
+        """Index of the extended attributes in the xattr id table."""
         return self._inode.xattr
 
+    @property
+    def xattrs(self):
+        """Dictionary of the extended attributes, names being prefixed by their namespace."""
+        if self._inode.xattr == SQUASHFS_INVALID_XATTR or not self._image._xattr_ids:
+            return {}
+        return dict(self._image._get_xattrs(self._inode.xattr))
+
     @property
     def filemode(self):
         return self._inode.filemode
@@ -133,6 +156,7 @@ class Directory(File):
         super(Directory, self).__init__(image, inode, name, parent)  # Python 2
         # OrderedDict for Python 3.6 and lower compatibility.
         self._children = children if children is not None else OrderedDict()
+        self._disk_usage = None
 
     def __len__(self):
         return len(self._children)
@@ -176,6 +200,30 @@ class Directory(File):
             else:
                 yield file
 
+    def disk_usage(self):
+        """Return the DiskUsage of this directory's subtree, computed from metadata only.
+
+        Every subdirectory's usage is computed in the same pass and kept,
+        so asking for it afterwards is free. Hard links and files mksquashfs
+        found to be duplicates are counted each time they appear, so that
+        the usage of a directory is the sum of that of its entries.
+        """
+        if self._disk_usage is None:
+            size = compressed_size = files = 0
+            for file in self._children.values():
+                if file.is_dir:
+                    usage = file.disk_usage()
+                    size += usage.size
+                    compressed_size += usage.compressed_size
+                    files += usage.files
+                    continue
+                files += 1
+                if file.is_file:
+                    size += file.inode.data
+                    compressed_size += self._image._compressed_size(file.inode)
+            self._disk_usage = DiskUsage(size, compressed_size, files)
+        return self._disk_usage
+
     def find(self, filename):
         """Find the first file with this name in the subtree."""
         for file in self.riter():
@@ -225,6 +273,24 @@ class RegularFile(File):
     def read_text(self, encoding="utf8", errors="strict"):
         return self.read_bytes().decode(encoding, errors)
 
+    def iter_raw_blocks(self, read=False):
+        """Iterate over the blocks holding the file's data as RawBlocks, without decompressing them.
+        Sparse blocks are left out, and the last one is the fragment block
+        holding the end of the file, at inode.offset, if any.
+        If `read` is true, the compressed bytes are read too.
+        """
+        return self._image._iter_raw_blocks(self._inode, read)
+
+    def iter_ranges(self):
+        """Iterate over (offset, size, hole) tuples describing where the data
+        and the holes of the file are, without decompressing anything.
+        """
+        return self._image._iter_ranges(self._inode)
+
+    def holes(self):
+        """Return the (offset, size) tuples of the holes of a sparse file."""
+        return [(offset, size) for offset, size, hole in self.iter_ranges() if hole]
+
 
 class Symlink(File):
 
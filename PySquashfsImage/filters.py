@@ -0,0 +1,78 @@
+import fnmatch
+import re
+
+
+def read_patterns(path):
+    """Return the patterns listed in a file, one per line.
+    Empty lines and lines starting with '#' are ignored.
+    """
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+class PathFilter(object):
+    """Select files with glob patterns.
+
+    Like with unsquashfs, patterns are matched component by component against
+    paths relative to the directory being walked: '*' never matches '/'.
+    A directory matching a pattern matches with its whole subtree.
+    Without include patterns, everything is included, then entries
+    matching an exclude pattern are left out with their subtree.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self._include = [self._compile(pattern) for pattern in include or ()]
+        self._exclude = [self._compile(pattern) for pattern in exclude or ()]
+
+    @staticmethod
+    def _compile(pattern):
+        parts = [part for part in pattern.split('/') if part and part != '.']
+        return tuple(re.compile(fnmatch.translate(part)).match for part in parts)
+
+    @staticmethod
+    def _match(pattern, parts):
+        """Return whether `pattern` matches the first components of `parts`."""
+        if len(pattern) > len(parts):
+            return False
+        for match, part in zip(pattern, parts):
+            if not match(part):
+                return False
+        return True
+
+    @staticmethod
+    def _leads_to(pattern, parts):
+        """Return whether `parts` may lead to a path matching `pattern`."""
+        return len(pattern) > len(parts) and PathFilter._match(pattern[: len(parts)], parts)
+
+    def excluded(self, parts):
+        return any(self._match(pattern, parts) for pattern in self._exclude)
+
+    def included(self, parts):
+        return not self._include or any(self._match(pattern, parts) for pattern in self._include)
+
+    def matches(self, parts):
+        """Return whether the file at `parts`, a sequence of path components, is selected."""
+        return self.included(parts) and not self.excluded(parts)
+
+    def traverses(self, parts):
+        """Return whether the directory at `parts` has to be walked,
+        because it is selected or may contain selected files.
+        """
+        if self.excluded(parts):
+            return False
+        return self.included(parts) or any(self._leads_to(pattern, parts) for pattern in self._include)
+
+    def walk(self, directory, _parts=()):
+        """Iterate over `directory` recursively like Directory.riter() but only over
+        the selected files and the directories that lead to them.
+        Pruned directories are never visited.
+        """
+        yield directory
+        for file in directory.iterdir():
+            parts = _parts + (file.name,)
+            if file.is_dir:
+                if self.traverses(parts):
+                    for f in self.walk(file, parts):
+                        yield f
+            elif self.matches(parts):
+                yield file
@@ -0,0 +1,60 @@
+import hashlib
+from collections import OrderedDict
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+
+def _content_key(file):
+    """Return a key equal for files whose data is stored in the same blocks,
+    like the duplicates mksquashfs detects and hard links.
+    """
+    inode = file.inode
+    image = file.image
+    blocks = ()
+    if inode.blocks:
+        blocks = tuple(image._read_block_list(inode.block_start, inode.block_offset, inode.blocks))
+    fragment = (inode.fragment, inode.offset, inode.frag_bytes) if inode.frag_bytes else None
+    return inode.data, inode.start if blocks else 0, blocks, fragment
+
+
+def _hash_file(file, algorithm):
+    hash_ = hashlib.new(algorithm)
+    for block in file.iter_bytes():
+        hash_.update(block)
+    return hash_.hexdigest()
+
+
+def hash_tree(subtree, algorithm="sha256", jobs=1, path_filter=None):
+    """Return an OrderedDict mapping the paths of the regular files of `subtree`,
+    sorted, to the hexadecimal digest of their content.
+
+    Files are read in the order their data is stored in the image, with `jobs`
+    threads if greater than 1, and files stored in the same blocks are only
+    read once. `path_filter` is an optional filters.PathFilter.
+    """
+    if not subtree.is_dir:
+        files = [subtree]
+    elif path_filter is not None:
+        files = path_filter.walk(subtree)
+    else:
+        files = subtree.riter()
+    hashlib.new(algorithm)  # Fail early if the algorithm isn't available.
+    groups = OrderedDict()  # Content key -> files.
+    for file in files:
+        if file.is_file:
+            groups.setdefault(_content_key(file), []).append(file)
+    image = subtree.image
+    groups = sorted(groups.values(), key=lambda group: image._data_position(group[0].inode))
+    if jobs > 1 and ThreadPoolExecutor is not None:
+        # hashlib and most decompressors release the GIL.
+        with ThreadPoolExecutor(jobs) as executor:
+            digests = list(executor.map(lambda group: _hash_file(group[0], algorithm), groups))
+    else:
+        digests = [_hash_file(group[0], algorithm) for group in groups]
+    result = []
+    for group, digest in zip(groups, digests):
+        result.extend((file.path, digest) for file in group)
+    return OrderedDict(sorted(result))
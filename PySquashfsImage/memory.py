@@ -0,0 +1,63 @@
+import sys
+from collections import OrderedDict
+
+
+def _sizeof(*objects):
+    return sum(sys.getsizeof(obj) for obj in objects)
+
+
+def _dict_size(dictionary):
+    """Return the size of a dictionary with its keys and values, which are assumed flat."""
+    return _sizeof(dictionary) + sum(_sizeof(key, value) for key, value in dictionary.items())
+
+
+def _tree_sizes(root):
+    """Return the size of the File objects of the tree under `root` and that of their inodes."""
+    tree = inodes = 0
+    seen = set()
+    for file in root.riter():
+        tree += _sizeof(file, file.__dict__, file._name)
+        if file.is_dir:
+            tree += _sizeof(file.children, *file.children)  # Keyed by decoded names.
+            if file._disk_usage is not None:
+                tree += _sizeof(file._disk_usage)
+        inode = file.inode
+        if id(inode) not in seen:
+            seen.add(id(inode))
+            inodes += _sizeof(inode, inode.__dict__, inode.header)
+            symlink = getattr(inode, "_symlink", None)
+            if symlink is not None:
+                inodes += _sizeof(symlink)
+    return tree, inodes
+
+
+def _cache_size(cache):
+    """Return the size of a cache.BlockCache, whose values are blocks or tuples holding one."""
+    size = _sizeof(cache._blocks)
+    for key, value in cache.items():
+        size += _sizeof(key, value) + (_sizeof(*value) if isinstance(value, tuple) else 0)
+    return size
+
+
+def memory_usage(image):
+    """Return an OrderedDict estimating the bytes held by the parts of `image`
+    from sys.getsizeof(), see SquashFsImage.memory_usage().
+    """
+    tree, inodes = _tree_sizes(image._root)
+    xattr_cache = image._xattr_cache
+    fragment_usage = image._fragment_usage_cache
+    usage = OrderedDict([
+        ("tree", tree),
+        ("inodes", inodes),
+        ("inode table cache", _cache_size(image._inode_table_cache)),
+        ("directory table cache", _cache_size(image._directory_table_cache)),
+        ("data cache", _cache_size(image._data_cache)),
+        ("fragment table", _sizeof(image._fragment_table, *image._fragment_table) + (
+            _dict_size(fragment_usage) if fragment_usage is not None else 0
+        )),
+        ("id table", _dict_size(image._id_table)),
+        ("xattrs", _sizeof(image._xattrs, image._xattr_ids, *image._xattr_ids) + _dict_size(image._hash_table)
+            + _sizeof(xattr_cache) + sum(_dict_size(xattrs) for xattrs in list(xattr_cache.values()))),
+    ])
+    usage["total"] = sum(usage.values())
+    return usage
@@ -0,0 +1,43 @@
+from collections import Counter
+
+
+def kind(file):
+    """Return the type of `file` as a string."""
+    if file.is_dir:
+        return "directory"
+    if file.is_file:
+        return "file"
+    if file.is_symlink:
+        return "symlink"
+    if file.is_block_device:
+        return "block_device"
+    if file.is_char_device:
+        return "char_device"
+    if file.is_fifo:
+        return "fifo"
+    return "socket"
+
+
+class Plan(object):
+    """What extracting a subtree would cost, see SquashFsImage.plan()."""
+
+    def __init__(self):
+        self.types = Counter()  # Number of entries by kind().
+        self.bytes_to_write = 0  # Uncompressed size of the files, hard links counted once.
+        self.bytes_to_read = 0  # Compressed size of the data blocks and fragment blocks.
+        self.data_blocks = 0
+        self.sparse_blocks = 0
+        self.fragment_blocks = 0  # Distinct fragment blocks.
+        self.blocks_to_decompress = 0  # Compressed data blocks and fragment blocks.
+        self.hard_links = 0  # Entries created as links to an entry seen before.
+        self.bytes_saved_by_links = 0
+
+    def __repr__(self):
+        return (
+            "{}(files={}, bytes_to_write={}, bytes_to_read={}, data_blocks={}, sparse_blocks={}, "
+            "fragment_blocks={}, blocks_to_decompress={}, hard_links={}, bytes_saved_by_links={})"
+        ).format(
+            self.__class__.__name__, sum(self.types.values()), self.bytes_to_write, self.bytes_to_read,
+            self.data_blocks, self.sparse_blocks, self.fragment_blocks, self.blocks_to_decompress,
+            self.hard_links, self.bytes_saved_by_links
+        )
@@ -0,0 +1,98 @@
+import threading
+from collections import Counter, OrderedDict
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    from time import time as clock
+
+# Caches of SquashFsImage whose hits and misses are counted.
+CACHES = ("data", "inode table", "directory table", "xattrs")
+
+
+class SharedCounter(object):
+    """Total of amounts added from several threads without taking a lock:
+    each thread adds to its own cell and the cells are summed when read.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()  # Only taken the first time a thread adds.
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells))
+
+    def add(self, amount):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0]
+            with self._lock:
+                self._cells.append(cell)
+        cell[0] += amount
+
+
+class Stats(object):
+    """Runtime counters of a SquashFsImage, see SquashFsImage.collect_stats().
+
+    Byte counts are taken from the image's own counters, maintained even when
+    stats aren't collected, the others are only counted while they are,
+    always with the lock of the image held.
+    """
+
+    def __init__(self, image):
+        # Reads from the image and ranges copied from it, not counting
+        # those of the table indexes when the image is opened.
+        self.reads = 0
+        self.seeks = 0  # Reads not starting where the previous one ended.
+        self.metadata_blocks = 0  # Metadata blocks decompressed.
+        self.data_blocks = 0  # Data and fragment blocks decompressed.
+        self.decompression_time = Counter()  # Seconds spent decompressing, by compressor name.
+        self.lookups = Counter()  # Cache name -> number of lookups.
+        self.misses = Counter()  # Cache name -> number of lookups that weren't cached.
+        self.inodes = 0  # Inodes decoded.
+        self.directories = 0  # Directory listings decoded.
+        self._image = image
+        self._read = image._bytes_read
+        self._decompressed = image._bytes_decompressed
+        self._end = None
+
+    def __repr__(self):
+        return "{}(reads={}, bytes_read={}, metadata_blocks={}, data_blocks={}, inodes={}, directories={})".format(
+            self.__class__.__name__, self.reads, self.bytes_read, self.metadata_blocks, self.data_blocks,
+            self.inodes, self.directories
+        )
+
+    @property
+    def bytes_read(self):
+        end = self._image._bytes_read if self._end is None else self._end[0]
+        return end - self._read
+
+    @property
+    def bytes_decompressed(self):
+        end = self._image._bytes_decompressed if self._end is None else self._end[1]
+        return end - self._decompressed
+
+    def stop(self):
+        """Stop the byte counts, the image stops updating the others itself."""
+        self._end = self._image._bytes_read, self._image._bytes_decompressed
+
+    def snapshot(self):
+        """Return the counters as a dictionary serializable to JSON."""
+        return OrderedDict([
+            ("reads", self.reads),
+            ("seeks", self.seeks),
+            ("bytes_read", self.bytes_read),
+            ("bytes_decompressed", self.bytes_decompressed),
+            ("metadata_blocks", self.metadata_blocks),
+            ("data_blocks", self.data_blocks),
+            ("decompression_time", dict(self.decompression_time)),
+            ("caches", OrderedDict(
+                (name, {"hits": self.lookups[name] - self.misses[name], "misses": self.misses[name]})
+                for name in CACHES
+            )),
+            ("inodes", self.inodes),
+            ("directories", self.directories),
+        ])
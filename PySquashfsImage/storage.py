@@ -0,0 +1,151 @@
+import posixpath
+from collections import OrderedDict
+from ctypes import sizeof
+
+from .const import SQUASHFS_INVALID_BLK, SQUASHFS_INVALID_FRAG, Compression
+from .macro import (
+    SQUASHFS_COMPRESSED_BLOCK,
+    SQUASHFS_COMPRESSED_SIZE_BLOCK,
+    SQUASHFS_FRAGMENT_BYTES,
+    SQUASHFS_ID_BYTES,
+    SQUASHFS_LOOKUP_BYTES,
+    SQUASHFS_XATTR_BYTES,
+)
+from .structure import XattrTable
+from .util import read_index
+
+
+def _bucket():
+    return OrderedDict([
+        ("files", 0),
+        ("bytes", 0),  # Uncompressed.
+        ("compressed_bytes", 0),  # Stored in the image, including a share of fragment blocks.
+        ("blocks", 0),
+        ("uncompressed_blocks", 0),  # Blocks stored as is because compressing them didn't help.
+        ("sparse_blocks", 0),
+    ])
+
+
+def _finish(bucket):
+    bucket["ratio"] = float(bucket["compressed_bytes"]) / bucket["bytes"] if bucket["bytes"] else None
+    bucket["uncompressed_block_share"] = (
+        float(bucket["uncompressed_blocks"]) / bucket["blocks"] if bucket["blocks"] else None
+    )
+    return bucket
+
+
+def _metadata_sizes(image):
+    """Return the size in the image of each metadata table, from the positions of the tables."""
+    sblk = image.sblk
+    sections = [("inode table", sblk.inode_table_start), ("directory table", sblk.directory_table_start)]
+    tables = []  # (name, index position, size in bytes)
+    if sblk.fragments:
+        tables.append(("fragment table", sblk.fragment_table_start, SQUASHFS_FRAGMENT_BYTES(sblk.fragments)))
+    if sblk.lookup_table_start != SQUASHFS_INVALID_BLK:
+        tables.append(("lookup table", sblk.lookup_table_start, SQUASHFS_LOOKUP_BYTES(sblk.inodes)))
+    tables.append(("id table", sblk.id_table_start, SQUASHFS_ID_BYTES(sblk.no_ids)))
+    if image._xattr_table_start is not None:
+        sections.append(("xattr table", image._xattr_table_start))
+        tables.append((
+            "xattr id table",
+            sblk.xattr_id_table_start + sizeof(XattrTable),
+            SQUASHFS_XATTR_BYTES(len(image._xattr_ids)),
+        ))
+    # A table's metadata blocks are followed by its index.
+    for name, start, total in tables:
+        sections.append((name, read_index(image, start, total)[0]))
+    sections.sort(key=lambda section: section[1])
+    ends = [start for _, start in sections[1:]] + [sblk.bytes_used]
+    return OrderedDict((name, end - start) for (name, start), end in zip(sections, ends))
+
+
+def storage_stats(image, subtree=None, depth=1):
+    """Return a dictionary, serializable to JSON, describing how the files of `subtree`
+    (the root directory by default) are stored, computed from metadata only.
+
+    Sizes are grouped by directory, down to `depth` levels below `subtree`,
+    and by file extension. Fragment blocks are shared between files
+    in proportion to the bytes they store in them. Files that mksquashfs
+    found to be duplicates are counted once, like hard links.
+    """
+    subtree = image.root if subtree is None else subtree
+    block_size = image.sblk.block_size
+    files = [file for file in (subtree.riter() if subtree.is_dir else [subtree]) if file.is_file]
+
+    total = _bucket()
+    directories = OrderedDict()
+    extensions = OrderedDict()
+    duplicates = {"files": 0, "bytes_saved": 0}
+    hard_links = {"links": 0, "bytes_saved": 0}
+    fragments = set()
+    linked = set()
+    contents = set()
+    prefix = len(subtree.path.rstrip('/')) + 1
+    for file in files:
+        inode = file.inode
+        if inode.nlink > 1:
+            if inode.inode_number in linked:
+                hard_links["links"] += 1
+                hard_links["bytes_saved"] += inode.data
+                continue
+            linked.add(inode.inode_number)
+        parts = file.path[prefix:].split('/')[:-1][:depth]
+        directory = posixpath.join(subtree.path, *parts)
+        buckets = [
+            total,
+            directories.setdefault(directory, _bucket()),
+            extensions.setdefault(posixpath.splitext(file.name)[1].lower(), _bucket()),
+        ]
+        stored = {"blocks": 0, "uncompressed_blocks": 0, "sparse_blocks": 0, "compressed_bytes": 0}
+        block_list = ()
+        if inode.blocks:
+            block_list = image._read_block_list(inode.block_start, inode.block_offset, inode.blocks)
+            for block in block_list:
+                if block == SQUASHFS_INVALID_FRAG:
+                    continue
+                if not block:
+                    stored["sparse_blocks"] += 1
+                    continue
+                stored["blocks"] += 1
+                if not SQUASHFS_COMPRESSED_BLOCK(block):
+                    stored["uncompressed_blocks"] += 1
+        key = (inode.start if block_list else 0, tuple(block_list), inode.fragment if inode.frag_bytes else None,
+               inode.offset, inode.data)
+        if inode.data and key in contents:
+            duplicates["files"] += 1
+            duplicates["bytes_saved"] += inode.data
+            stored = dict.fromkeys(stored, 0)
+        else:
+            contents.add(key)
+            if inode.frag_bytes:
+                fragments.add(inode.fragment)
+            stored["compressed_bytes"] = image._compressed_size(inode)
+        for bucket in buckets:
+            bucket["files"] += 1
+            bucket["bytes"] += inode.data
+            for name, value in stored.items():
+                bucket[name] += value
+
+    fragment_compressed = 0
+    fragment_uncompressed = 0
+    for fragment in fragments:
+        _, size = image._read_fragment(fragment)
+        fragment_compressed += SQUASHFS_COMPRESSED_SIZE_BLOCK(size)
+        fragment_uncompressed += image._fragment_usage()[fragment][1]
+    return OrderedDict([
+        ("compression", Compression(image.sblk.compression).name.lower()),
+        ("block_size", block_size),
+        ("total", _finish(total)),
+        ("directories", OrderedDict((key, _finish(value)) for key, value in sorted(directories.items()))),
+        ("extensions", OrderedDict((key, _finish(value)) for key, value in sorted(extensions.items()))),
+        ("fragments", OrderedDict([
+            ("blocks", len(fragments)),
+            ("bytes", fragment_uncompressed),
+            ("compressed_bytes", fragment_compressed),
+            # How full fragment blocks are, 1 meaning no space is lost.
+            ("packing_efficiency", float(fragment_uncompressed) / (len(fragments) * block_size) if fragments else None),
+        ])),
+        ("duplicates", duplicates),
+        ("hard_links", hard_links),
+        ("metadata", _metadata_sizes(image)),
+    ])
@@ -210,6 +210,31 @@ class XattrId(_Base):
         return self._size
 
 
+class XattrEntry(_Base):
+    _fields_ = [
+        ("_type", c_uint16),
+        ("_size", c_uint16),
+    ]
+
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def size(self):
+        return self._size
+
+
+class XattrVal(_Base):
+    _fields_ = [
+        ("_vsize", c_uint32),
+    ]
+
+    @property
+    def vsize(self):
+        return self._vsize
+
+
 class XattrTable(_Base):
     _fields_ = [
         ("_xattr_table_start", c_uint64),
@@ -253,6 +253,10 @@ class _RegularFileInodeCommon:
     def block_list(self):
         return self._block_list
 
+    @property
+    def nlink(self):
+        return 1  # Only extended inodes can have more than one link.
+
     # These fields are either shortcuts or filled in read_inode().
 
     @property
@@ -1,20 +1,58 @@
+import gc
+import hashlib
 import io
+import json
 import os
 import subprocess
 import tarfile
 import tempfile
+import zlib
 
 import pytest
 
 import PySquashfsImage
+from PySquashfsImage import extract
+from PySquashfsImage.cache import MemoryBudget
+from PySquashfsImage.diff import diff
+from PySquashfsImage.export import export_tar
+from PySquashfsImage.extract import extract_dir
+from PySquashfsImage.filters import PathFilter
+from PySquashfsImage.manifest import hash_tree
+from PySquashfsImage.storage import storage_stats
+from PySquashfsImage.tracing import ChromeTracer, Tracer
+from PySquashfsImage.verify import verify
 
 
-def _createFile(tarArchive, name, contents):
+def _createFile(tarArchive, name, contents, xattrs=None):
     tinfo = tarfile.TarInfo(name)
     tinfo.size = len(contents)
+    if xattrs:
+        tinfo.pax_headers = {"SCHILY.xattr." + key: value for key, value in xattrs.items()}
     tarArchive.addfile(tinfo, io.BytesIO(contents.encode()))
 
 
+def _createLink(tarArchive, name, target):
+    tinfo = tarfile.TarInfo(name)
+    tinfo.type = tarfile.LNKTYPE
+    tinfo.linkname = target
+    tarArchive.addfile(tinfo)
+
+
+def _createSquashfs(tmpdir, files, compressionOptions=(), xattrs=None):
+    tarPath = os.path.join(tmpdir, "image.tar")
+    with tarfile.open(name=tarPath, mode='w:', format=tarfile.PAX_FORMAT) as tarArchive:
+        for name, contents in files.items():
+            _createFile(tarArchive, name, contents, (xattrs or {}).get(name))
+        _createLink(tarArchive, "hardlink", "foo")
+    squashfsPath = os.path.join(tmpdir, "image.squashfs")
+    process = subprocess.Popen(
+        ["sqfstar"] + list(compressionOptions) + [squashfsPath], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+    with open(tarPath, 'rb') as file:
+        process.communicate(file.read())
+    return squashfsPath
+
+
 @pytest.mark.parametrize("compression", ["", "gzip", "lz4", "lzma", "lzo", "xz", "zstd"])
 def test_compressions(compression):
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -36,3 +74,567 @@ def test_compressions(compression):
             assert entries[0].path == "/"
             assert entries[1].path == "/foo"
             assert image.read_file(entries[1].inode) == b"bar"
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+@pytest.mark.parametrize("compressionOptions", [["-comp", "gzip"], ["-comp", "gzip", "-noD"]])
+def test_extract_dir(jobs, compressionOptions):
+    files = {"foo": "bar", "dir/baz": "qux" * 100000, "dir/sub/empty": ""}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, compressionOptions)
+        dest = os.path.join(tmpdir, "root")
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            extract_dir(image.root, dest, jobs=jobs)
+        for name, contents in files.items():
+            with open(os.path.join(dest, name)) as file:
+                assert file.read() == contents
+        assert os.path.samefile(os.path.join(dest, "foo"), os.path.join(dest, "hardlink"))
+
+
+@pytest.mark.skipif(not extract._supports_dir_fd, reason="no dir_fd support")
+def test_extract_dir_dir_fd(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tarPath = os.path.join(tmpdir, "image.tar")
+        with tarfile.open(name=tarPath, mode='w:') as tarArchive:
+            _createFile(tarArchive, "dir/foo", "bar")
+            for name, type_ in (("dir/link", tarfile.SYMTYPE), ("dir/fifo", tarfile.FIFOTYPE)):
+                tinfo = tarfile.TarInfo(name)
+                tinfo.type = type_
+                tinfo.linkname = "foo"
+                tarArchive.addfile(tinfo)
+            _createLink(tarArchive, "dir/hardlink", "dir/foo")
+        squashfsPath = os.path.join(tmpdir, "image.squashfs")
+        with open(tarPath, 'rb') as file:
+            subprocess.run(["sqfstar", "-comp", "gzip", squashfsPath], input=file.read(), stdout=subprocess.PIPE)
+        calls = []
+        for module, name in ((os, "open"), (os, "symlink"), (os, "link"), (extract, "mknod")):
+            def spy(*args, _function=getattr(module, name), **kwargs):
+                calls.append((_function.__name__, "dir_fd" in kwargs or "dst_dir_fd" in kwargs))
+                return _function(*args, **kwargs)
+            monkeypatch.setattr(module, name, spy)
+        monkeypatch.setattr(extract, "supports_follow_symlinks", extract.supports_follow_symlinks | {os.link})
+        dest = os.path.join(tmpdir, "root")
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            extract_dir(image.root, dest)
+        monkeypatch.undo()
+        with open(os.path.join(dest, "dir", "foo")) as file:
+            assert file.read() == "bar"
+        assert os.readlink(os.path.join(dest, "dir", "link")) == "foo"
+        assert os.path.samefile(os.path.join(dest, "dir", "foo"), os.path.join(dest, "dir", "hardlink"))
+    # Directories are opened by path, entries are created relative to them.
+    assert sorted(set(call for call in calls if call[0] != "open")) == [
+        ("link", True), ("mknod", True), ("symlink", True)
+    ]
+    assert ("open", True) in calls
+
+
+def test_lookup_table():
+    files = {"foo": "bar", "dir/baz": "qux"}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            fooInode = image.select("/foo").inode.inode_number
+            table = extract.LookupTable(image.sblk.inodes)
+            extract_dir(image.root, os.path.join(tmpdir, "root"), lookup_table=table)
+            # Dictionaries in the format of earlier versions are still accepted.
+            paths = {}
+            extract.extract_file(image.select("/dir/baz"), os.path.join(tmpdir, "baz"), lookup_table=paths)
+            extract.extract_file(image.select("/foo"), os.path.join(tmpdir, "foo"), lookup_table=paths)
+            extract.extract_file(image.select("/hardlink"), os.path.join(tmpdir, "hardlink"), lookup_table=paths)
+            extract_dir(image.select("/dir"), os.path.join(tmpdir, "dir"), lookup_table=paths)
+        assert os.path.samefile(os.path.join(tmpdir, "foo"), os.path.join(tmpdir, "hardlink"))
+    # Only inodes with several links are tracked.
+    assert table._paths == {0: {fooInode - 1: os.path.join(tmpdir, "root", "foo")}}
+    assert paths == {0: {fooInode - 1: os.path.join(tmpdir, "foo")}}
+    with pytest.raises(ValueError):
+        extract.extract_file(image.select("/hardlink"), "hardlink", lookup_table={fooInode: "foo"})
+    # Tables grow for images with more inodes.
+    table = extract.LookupTable(8)
+    assert table.claim(8) and table.claim(1000) and not table.claim(1000)
+
+
+def test_iter_files_by_disk_order():
+    files = {"foo": "bar", "dir/a": "a" * 300000, "dir/b": "b", "dir/sub/c": "c" * 200000, "dir/sub/d": "dd"}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            ordered = list(image.iter_files_by_disk_order())
+            positions = [image._data_position(file.inode) for file in ordered]
+            subtree = [file.path for file in image.iter_files_by_disk_order(image.select("/dir"))]
+    assert positions == sorted(positions)
+    assert sorted(file.path for file in ordered) == sorted(["/" + name for name in files] + ["/hardlink"])
+    assert sorted(subtree) == ["/dir/a", "/dir/b", "/dir/sub/c", "/dir/sub/d"]
+
+
+def test_extract_dir_zstd_jobs():
+    pytest.importorskip("zstandard")
+    files = {"foo": "bar"}
+    files.update(("dir{}/file{}".format(i, j), "{}-{}".format(i, j) * 50000) for i in range(4) for j in range(4))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "zstd", "-b", "4K"])
+        dest = os.path.join(tmpdir, "root")
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            extract_dir(image.root, dest, jobs=8)
+        for name, contents in files.items():
+            with open(os.path.join(dest, name)) as file:
+                assert file.read() == contents
+
+
+def test_extract_dir_incremental():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        dest = os.path.join(tmpdir, "root")
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            extract_dir(image.root, dest)
+            with open(os.path.join(dest, "dir", "baz"), "w") as file:
+                file.write("changed")
+            with open(os.path.join(dest, "stray"), "w") as file:
+                file.write("not in the image")
+            summary = extract_dir(image.root, dest, incremental=True)
+        assert (summary.written, summary.skipped, summary.removed) == (1, 2, 1)
+        assert summary.bytes_skipped == len(files["foo"])
+        assert not os.path.exists(os.path.join(dest, "stray"))
+        with open(os.path.join(dest, "dir", "baz")) as file:
+            assert file.read() == files["dir/baz"]
+
+
+def test_xattrs():
+    xattrs = {"foo": {"user.a": "1", "user.b": "2"}, "dir/baz": {"user.a": "1", "user.b": "2"}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, {"foo": "bar", "dir/baz": "qux"}, ["-comp", "gzip"], xattrs)
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            assert image.select("/foo").xattrs == {"user.a": b"1", "user.b": b"2"}
+            assert image.select("/dir/baz").xattrs == {"user.a": b"1", "user.b": b"2"}
+            assert image.select("/dir").xattrs == {}
+
+
+@pytest.mark.skipif(not hasattr(os, "setxattr"), reason="no xattr support")
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_extract_dir_xattrs(jobs):
+    xattrs = {"foo": {"user.a": "1", "user.b": "2"}, "dir/baz": {"user.c": "3"}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with tempfile.NamedTemporaryFile(dir=tmpdir) as file:
+            try:
+                os.setxattr(file.name, "user.probe", b"")
+            except OSError:
+                pytest.skip("the file system doesn't support user xattrs")
+        squashfsPath = _createSquashfs(tmpdir, {"foo": "bar", "dir/baz": "qux"}, ["-comp", "gzip"], xattrs)
+        dest = os.path.join(tmpdir, "root")
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            extract_dir(image.root, dest, jobs=jobs)
+        for name, values in xattrs.items():
+            path = os.path.join(dest, name)
+            assert {key: os.getxattr(path, key) for key in os.listxattr(path)} == {
+                key: value.encode() for key, value in values.items()
+            }
+
+
+def test_extract_dir_filter():
+    files = {"foo": "bar", "dir/baz": "qux", "dir/sub/empty": "", "dir/sub/other": "quux"}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        dest = os.path.join(tmpdir, "root")
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            summary = extract_dir(image.root, dest, path_filter=PathFilter(["dir"], ["dir/sub/e*"]))
+        assert summary.written == 2
+        assert sorted(os.listdir(dest)) == ["dir"]
+        assert sorted(os.listdir(os.path.join(dest, "dir", "sub"))) == ["other"]
+
+
+def test_export_tar():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    xattrs = {"foo": {"user.a": "1"}}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"], xattrs)
+        output = io.BytesIO()
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            export_tar(image.root, output, "gz")
+        output.seek(0)
+        with tarfile.open(fileobj=output) as tarArchive:
+            members = {member.name: member for member in tarArchive}
+            for name, contents in files.items():
+                assert tarArchive.extractfile(members[name]).read() == contents.encode()
+            assert members["."].isdir()
+            assert members["hardlink"].islnk() and members["hardlink"].linkname == "foo"
+            assert members["foo"].pax_headers["SCHILY.xattr.user.a"] == "1"
+
+
+def test_write_all_short_writes(monkeypatch):
+    def writev(fd, buffers):
+        # Only write part of the first buffers, like a signal or a full pipe would.
+        return os.write(fd, b''.join(buffers)[:3])
+
+    monkeypatch.setattr(extract, "writev", writev)
+    with tempfile.TemporaryFile() as file:
+        extract._write_all(file.fileno(), [b"foo", b"", b"barbaz", b"qux"])
+        file.seek(0)
+        assert file.read() == b"foobarbazqux"
+
+
+def test_appropriate_umask_nested(monkeypatch):
+    calls = []
+    umask = os.umask
+    monkeypatch.setattr(extract, "_root", True)
+    monkeypatch.setattr(os, "umask", lambda mask: (calls.append(mask), umask(mask))[1])
+    previous = umask(0o22)
+    try:
+        with extract.appropriate_umask():
+            # Like the threads of extract_dir() writing files.
+            for _ in range(2):
+                with extract.appropriate_umask():
+                    pass
+    finally:
+        umask(previous)
+    assert calls == [0, 0o22]
+
+
+def test_copy_range_returning_zero(monkeypatch):
+    # Like copy_file_range() on file systems that don't support it.
+    monkeypatch.setattr(extract, "copy_file_range", lambda src, dst, count, offset: 0)
+    monkeypatch.setattr(extract, "_sendfile", None)
+    with tempfile.TemporaryFile() as src, tempfile.TemporaryFile() as dst:
+        src.write(b"foobarbaz")
+        src.flush()
+        extract._copy_range(src.fileno(), dst.fileno(), 3, 6)
+        dst.seek(0)
+        assert dst.read() == b"barbaz"
+
+
+def test_sparse_file():
+    files = {"foo": "bar", "sparse": "x" * 4096 + "\0" * 8192}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip", "-b", "4K", "-no-fragments"])
+        dest = os.path.join(tmpdir, "root")
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            sparse = image.select("/sparse")
+            assert list(sparse.iter_ranges()) == [(0, 4096, False), (4096, 8192, True)]
+            assert sparse.holes() == [(4096, 8192)]
+            assert image.select("/foo").holes() == []
+            extract_dir(image.root, dest)
+        with open(os.path.join(dest, "sparse")) as file:
+            assert file.read() == files["sparse"]
+
+
+def test_extract_dir_progress():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    phases = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            progress = []
+            extract_dir(image.root, os.path.join(tmpdir, "root"),
+                        progress=lambda p: (phases.append(p.phase), progress.append(p)))
+    assert phases.index("directories") < phases.index("files") < phases.index("links") < phases.index("attributes")
+    progress = progress[-1]
+    assert progress.done
+    assert (progress.files, progress.files_total) == (3, 3)
+    assert progress.bytes_written == len(files["foo"]) + len(files["dir/baz"])
+    assert progress.bytes_decompressed >= progress.bytes_written
+    assert list(progress.elapsed) == ["directories", "files", "links", "attributes"]
+
+
+def test_plan():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000, "dir/sub/empty": ""}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            plan = image.plan()
+            assert image.plan(image.root, PathFilter(exclude=["dir"])).bytes_to_write == len(files["foo"])
+            bytes_read = image._bytes_read
+            extract_dir(image.root, os.path.join(tmpdir, "root"))
+            assert image._bytes_read - bytes_read == plan.bytes_to_read
+    assert plan.types == {"directory": 3, "file": 4}
+    assert plan.bytes_to_write == sum(len(contents) for contents in files.values())
+    assert (plan.hard_links, plan.bytes_saved_by_links) == (1, len(files["foo"]))
+    assert plan.data_blocks == 2
+
+
+def test_verify():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            report = verify(image, jobs=2)
+            start = image.select("/dir/baz").inode.start
+        assert report.ok and report.blocks > 0
+        with open(squashfsPath, "rb") as file:
+            data = bytearray(file.read())
+        data[start + 10] ^= 0xFF
+        with PySquashfsImage.SquashFsImage.from_bytes(bytes(data)) as image:
+            report = verify(image)
+        assert [(problem.what, problem.position, problem.files) for problem in report.problems] == [
+            ("data block", start, ["/dir/baz"])
+        ]
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            # A corrupt xattr table start past every other table.
+            image._xattr_table_start = image.sblk.bytes_used + 1
+            report = verify(image)
+        assert report.blocks > 0
+
+
+def test_verify_zstd_jobs():
+    pytest.importorskip("zstandard")
+    files = {"foo": "bar"}
+    files.update(("file{}".format(i), str(i) * 100000) for i in range(8))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "zstd", "-b", "4K"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            report = verify(image, jobs=8)
+    assert report.ok and report.blocks > 8
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_hash_tree(jobs):
+    files = {"foo": "bar", "dir/baz": "qux" * 100000, "dir/copy": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            digests = hash_tree(image.root, jobs=jobs)
+            assert list(hash_tree(image.select("/dir"), "md5", jobs)) == ["/dir/baz", "/dir/copy"]
+    expected = {"/" + name: hashlib.sha256(contents.encode()).hexdigest() for name, contents in files.items()}
+    expected["/hardlink"] = expected["/foo"]
+    assert digests == expected
+    assert list(digests) == sorted(expected)
+
+
+def test_hash_tree_zstd_jobs():
+    pytest.importorskip("zstandard")
+    files = {"foo": "bar"}
+    files.update(("file{}".format(i), str(i) * 100000) for i in range(8))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "zstd", "-b", "4K"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            digests = hash_tree(image.root, jobs=8)
+    expected = {"/" + name: hashlib.sha256(contents.encode()).hexdigest() for name, contents in files.items()}
+    expected["/hardlink"] = expected["/foo"]
+    assert digests == expected
+
+
+def test_diff():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000, "dir/same": "same" * 50000, "gone": ""}
+    newFiles = {"foo": "bar", "dir/baz": "qux" * 99999 + "QUX", "dir/same": "same" * 50000, "new": ""}
+    with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as newTmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        newSquashfsPath = _createSquashfs(newTmpdir, newFiles, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as old, \
+                PySquashfsImage.SquashFsImage.from_file(newSquashfsPath) as new:
+            changes = diff(old.root, new.root)
+            assert diff(old.root, old.root) == []
+    # sqfstar may give the root directories different times.
+    assert [str(change) for change in changes if change.path != "/"] == ["M /dir/baz (content)", "- /gone", "+ /new"]
+
+
+def test_diff_fragment_layouts():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as newTmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        newSquashfsPath = _createSquashfs(newTmpdir, files, ["-comp", "gzip", "-no-fragments"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as old, \
+                PySquashfsImage.SquashFsImage.from_file(newSquashfsPath) as new:
+            assert old.select("/dir/baz").inode.frag_bytes and not new.select("/dir/baz").inode.frag_bytes
+            changes = diff(old.root, new.root)
+    assert [change for change in changes if change.path != "/"] == []
+
+
+def test_raw_blocks():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            blockSize = image.sblk.block_size
+            blocks = list(image.select("/dir/baz").iter_raw_blocks(read=True))
+            allBlocks = list(image.iter_all_blocks())
+    assert [block.fragment for block in blocks] == [False, False, True]
+    assert [block.size for block in blocks] == [blockSize, blockSize, None]
+    assert b''.join(zlib.decompress(block.data) for block in blocks[:2]) == files["dir/baz"][:2 * blockSize].encode()
+    assert [block.offset for block in allBlocks] == sorted(block.offset for block in allBlocks)
+    assert set(block._replace(data=None) for block in blocks) <= set(allBlocks)
+
+
+def test_storage_stats():
+    files = {"foo": "bar", "dir/baz.txt": "qux" * 100000, "dir/copy.bin": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            decompressed = image._bytes_decompressed
+            stats = storage_stats(image)
+            assert image._bytes_decompressed == decompressed
+            bytesUsed = image.sblk.bytes_used
+    json.dumps(stats)
+    assert stats["total"]["files"] == 3  # The hard link isn't counted.
+    assert stats["total"]["bytes"] == sum(len(contents) for contents in files.values())
+    assert stats["duplicates"] == {"files": 1, "bytes_saved": len(files["dir/copy.bin"])}
+    assert stats["hard_links"] == {"links": 1, "bytes_saved": len(files["foo"])}
+    assert list(stats["directories"]) == ["/", "/dir"]
+    assert list(stats["extensions"]) == ["", ".bin", ".txt"]
+    assert 0 < sum(stats["metadata"].values()) < bytesUsed
+
+
+def test_disk_usage():
+    files = {"foo": "bar", "dir/a": "qux" * 100000, "dir/sub/b": "baz", "dir/sub/c": "quux"}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            usage = image.root.disk_usage()
+            sub = image.select("/dir/sub")
+            assert sub._disk_usage is not None  # Filled by the same pass.
+            subUsage = sub.disk_usage()
+            dirUsage = image.select("/dir").disk_usage()
+            fooSize = image._compressed_size(image.select("/foo").inode)
+    # The hard link to foo is counted like any other entry.
+    assert usage.files == len(files) + 1
+    assert usage.size == sum(len(contents) for contents in files.values()) + len(files["foo"])
+    assert subUsage.files == 2
+    assert subUsage.size == len(files["dir/sub/b"]) + len(files["dir/sub/c"])
+    assert dirUsage.files == 3
+    assert usage.compressed_size == dirUsage.compressed_size + 2 * fooSize
+    assert subUsage.compressed_size < dirUsage.compressed_size < len(files["dir/a"])
+
+
+def test_stats():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath, stats=True) as image:
+            opened = image.stats()
+            with image.collect_stats() as stats:
+                baz = image.select("/dir/baz")
+                image.read_file(baz.inode)
+                image.read_file(baz.inode)
+            after = image.stats()
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            idle = image.stats()
+    json.dumps(opened)
+    assert opened["inodes"] == len(files) + 3  # Root, dir and the hard link.
+    assert opened["directories"] == 2
+    assert opened["caches"]["inode table"]["misses"] > 0
+    assert opened["bytes_read"] == idle["bytes_read"] > 0
+    assert idle["inodes"] == 0
+    snapshot = stats.snapshot()
+    assert snapshot["inodes"] == 0
+    data = snapshot["caches"]["data"]
+    assert data["misses"] == stats.data_blocks > 0
+    assert 0 < stats.seeks < stats.reads  # Consecutive blocks are read without seeking.
+    assert data["hits"] + data["misses"] == 2 * data["misses"]
+    assert snapshot["bytes_decompressed"] >= len(files["dir/baz"])  # Fragment blocks are shared.
+    assert list(snapshot["decompression_time"]) == ["gzip"]
+    # The counters collected when opening the image are restored.
+    assert after["inodes"] == opened["inodes"]
+
+
+@pytest.mark.skipif(not (extract.copy_file_range or extract.sendfile), reason="no kernel copies")
+def test_stats_kernel_copies():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip", "-noD", "-no-fragments"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath, stats=True) as image:
+            baz = image.select("/dir/baz")
+            with image.collect_stats() as stats:
+                extract.extract_file(baz, os.path.join(tmpdir, "baz"))
+    # Uncompressed blocks are copied by the kernel one after the other.
+    assert (stats.reads, stats.seeks) == (3, 1)
+
+
+def test_tracing():
+    class RecordingTracer(Tracer):
+        def __init__(self):
+            self.spans = []
+
+        def start(self, name, args):
+            self.spans.append(("start", name))
+            return name
+
+        def end(self, token):
+            self.spans.append(("end", token))
+
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    tracer = RecordingTracer()
+    chrome = ChromeTracer()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath, tracer=tracer) as image:
+            image.select("/foo").read_bytes()
+            image.tracer = chrome
+            extract_dir(image.root, os.path.join(tmpdir, "root"))
+            image.tracer = None
+            image.select("/dir/baz").read_bytes()
+        trace = io.StringIO()
+        chrome.write(trace)
+    names = [name for event, name in tracer.spans if event == "start"]
+    phases = ["read_super", "read_uids_guids", "read_fragment_table", "read_xattrs_from_disk", "dir_scan"]
+    assert [name for name in names if name in phases] == phases
+    assert "read_file" in names and "read" in names
+    # Spans are properly nested.
+    stack = []
+    for event, name in tracer.spans:
+        if event == "start":
+            stack.append(name)
+        else:
+            assert stack.pop() == name
+    assert not stack
+    events = json.loads(trace.getvalue())["traceEvents"]
+    assert {"extract_dir", "directories", "files", "links", "attributes", "extract_file", "write_file",
+            "data_block", "decompress"} <= {event["name"] for event in events}
+    assert all(event["ph"] == 'X' and event["dur"] >= 0 for event in events)
+    extractDir = [event for event in events if event["name"] == "extract_dir"][0]
+    assert all(extractDir["ts"] <= event["ts"] <= extractDir["ts"] + extractDir["dur"] for event in events)
+
+
+def test_memory_usage():
+    files = {"foo": "bar", "dir/baz": "qux" * 100000}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip"])
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath) as image:
+            before = image.memory_usage()
+            image.select("/dir/baz").read_bytes()
+            after = image.memory_usage()
+            image._data_cache.clear()
+            cleared = image.memory_usage()
+    assert list(before) == ["tree", "inodes", "inode table cache", "directory table cache", "data cache",
+                            "fragment table", "id table", "xattrs", "total"]
+    assert before["total"] == sum(value for name, value in before.items() if name != "total")
+    assert before["tree"] > 0 and before["inodes"] > 0 and before["inode table cache"] > 0
+    # The blocks of baz and the fragment block holding its end are cached.
+    assert after["data cache"] - before["data cache"] >= len(files["dir/baz"])
+    assert cleared["data cache"] < after["data cache"] - len(files["dir/baz"])
+
+
+def test_memory_budget():
+    files = {"foo": "bar", "a": os.urandom(150000).hex(), "b": os.urandom(150000).hex()}
+    budget = MemoryBudget(200000)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        squashfsPath = _createSquashfs(tmpdir, files, ["-comp", "gzip", "-b", "64K"])
+        first = PySquashfsImage.SquashFsImage.from_file(squashfsPath, budget=budget)
+        with PySquashfsImage.SquashFsImage.from_file(squashfsPath, budget=budget) as second:
+            assert 0 < budget.used < budget.limit  # Metadata blocks read when opening.
+            assert first.select("/a").read_bytes().decode() == files["a"]
+            assert budget.used <= budget.limit
+            assert second.select("/b").read_bytes().decode() == files["b"]
+            assert budget.used <= budget.limit
+            # The blocks of a were evicted, least recently used first, to make room for those of b.
+            assert first._data_cache.nbytes < len(files["a"]) // 2
+            assert second._data_cache.nbytes > 0
+            caches = [first._inode_table_cache, first._directory_table_cache, first._data_cache,
+                      second._inode_table_cache, second._directory_table_cache, second._data_cache]
+            assert budget.used == sum(cache.nbytes for cache in caches)
+            # Evicted blocks are read again.
+            assert first.select("/a").read_bytes().decode() == files["a"]
+            first.close()
+            assert budget.used == sum(cache.nbytes for cache in caches[3:])
+        assert budget.used == 0
+        # Images on a file object of the caller give their memory back too.
+        with open(squashfsPath, "rb") as file:
+            with PySquashfsImage.SquashFsImage(file, closefd=False, budget=budget) as image:
+                assert image.select("/a").read_bytes().decode() == files["a"]
+                assert budget.used > 0
+            assert not file.closed
+        assert budget.used == 0 and not budget._entries
+        # Images dropped without being closed give their memory back once collected.
+        image = PySquashfsImage.SquashFsImage.from_file(squashfsPath, budget=budget)
+        assert image.select("/a").read_bytes().decode() == files["a"]
+        assert budget.used > 0
+        image._fd.close()
+        del image
+        gc.collect()
+        assert budget.used == 0 and not budget._entries
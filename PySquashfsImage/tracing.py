@@ -0,0 +1,106 @@
+import json
+import os
+import threading
+
+from .stats import clock
+
+
+class Tracer(object):
+    """Receives the spans of a SquashFsImage, see SquashFsImage.tracer.
+
+    Subclasses override start() and end(), which can be called from several
+    threads at once. Spans are named after what they cover: the phases of opening
+    an image ("read_super", "read_uids_guids", "read_fragment_table",
+    "read_xattrs_from_disk", "dir_scan"), "read", "metadata_block", "data_block",
+    "decompress", "read_file", and those of extract_dir() ("extract_dir",
+    its phases, "extract_file", "write_file").
+    """
+
+    def start(self, name, args):
+        """Called when a span starts, `args` being a dictionary describing it or None.
+        The value returned is passed to end().
+        """
+        return None
+
+    def end(self, token):
+        """Called when the span that start() returned `token` for ends."""
+
+
+class ChromeTracer(Tracer):
+    """Tracer recording spans in the Chrome trace event format,
+    which chrome://tracing and https://ui.perfetto.dev display as timelines.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._pid = os.getpid()
+        self._origin = clock()
+
+    def start(self, name, args):
+        return name, args, clock()
+
+    def end(self, token):
+        name, args, start = token
+        event = {
+            "name": name,
+            "cat": "squashfs",
+            "ph": 'X',
+            "ts": (start - self._origin) * 1e6,  # Microseconds.
+            "dur": (clock() - start) * 1e6,
+            "pid": self._pid,
+            "tid": threading.current_thread().ident,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def write(self, fileobj):
+        """Write the trace as JSON to a text file object."""
+        json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, fileobj)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            self.write(f)
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, args):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+        self._token = None
+
+    def __enter__(self):
+        self._token = self._tracer.start(self._name, self._args)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._tracer.end(self._token)
+
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(tracer, name, args=None):
+    """Return a context manager making a span of its block if `tracer` isn't None."""
+    return _NO_SPAN if tracer is None else _Span(tracer, name, args)
+
+
+def trace_iter(tracer, name, iterable, args=None):
+    """Iterate over `iterable` in a span lasting until it is exhausted or closed."""
+    token = tracer.start(name, args)
+    try:
+        for item in iterable:
+            yield item
+    finally:
+        tracer.end(token)
@@ -1,7 +1,9 @@
 import io
+import struct
+import sys
 from functools import partial
 
-from .const import SQUASHFS_MAGIC, Compression
+from .const import SQUASHFS_MAGIC, SQUASHFS_METADATA_SIZE, Compression
 from .structure import Superblock
 
 
@@ -10,6 +12,10 @@ try:
 except AttributeError:
     MAGIC_BYTES = b'hsqs'  # Python 2
 
+# Error handler for decoding names and values that may not be valid UTF-8,
+# "surrogateescape" keeps their bytes but doesn't exist on Python 2.
+DECODE_ERRORS = "surrogateescape" if sys.version_info >= (3,) else "replace"
+
 
 def check_super(sblk):
     if sblk.s_magic != SQUASHFS_MAGIC or sblk.s_major != 4 or sblk.s_minor != 0:
@@ -19,6 +25,17 @@ def check_super(sblk):
     return True
 
 
+def read_index(image, start, total):
+    """Return the positions of the metadata blocks of a `total` bytes long table
+    whose index is at `start`.
+    """
+    count = (total + SQUASHFS_METADATA_SIZE - 1) // SQUASHFS_METADATA_SIZE
+    data = image._read(start, 8 * count)
+    if len(data) != 8 * count:
+        raise IOError("truncated index")
+    return struct.unpack("<{}Q".format(count), data)
+
+
 def _find_superblocks(stream, size=1024**2):
     stream.seek(0)
     indexes = set()
@@ -0,0 +1,227 @@
+from collections import OrderedDict
+from ctypes import sizeof
+
+from .const import SQUASHFS_INVALID_BLK, SQUASHFS_INVALID_FRAG, SQUASHFS_METADATA_SIZE
+from .macro import (
+    SQUASHFS_COMPRESSED_BLOCK,
+    SQUASHFS_COMPRESSED_SIZE_BLOCK,
+    SQUASHFS_FRAGMENT_BYTES,
+    SQUASHFS_ID_BYTES,
+    SQUASHFS_LOOKUP_BYTES,
+    SQUASHFS_XATTR_BYTES,
+)
+from .structure import XattrTable
+from .util import read_index
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+
+class Problem(object):
+    """A block that couldn't be read or decompressed, or doesn't have the expected size."""
+
+    def __init__(self, what, position, message, files=()):
+        self.what = what  # "data block", "fragment block" or the name of a metadata table.
+        self.position = position  # Relative to the start of the image.
+        self.message = message
+        self.files = list(files)  # Paths of the files whose content is affected.
+
+    def __repr__(self):
+        return "{}({!r}, {}, {!r}, files={!r})".format(
+            self.__class__.__name__, self.what, self.position, self.message, self.files
+        )
+
+    def __str__(self):
+        return "{} at 0x{:X}: {}".format(self.what, self.position, self.message)
+
+
+class Report(object):
+    """Result of verify()."""
+
+    def __init__(self):
+        self.blocks = 0  # Number of blocks checked.
+        self.problems = []
+
+    def __repr__(self):
+        return "{}(blocks={}, problems={})".format(self.__class__.__name__, self.blocks, len(self.problems))
+
+    @property
+    def ok(self):
+        return not self.problems
+
+
+def _metadata_size(total, index):
+    """Return the expected uncompressed size of block `index` of a `total` bytes long table."""
+    return min(SQUASHFS_METADATA_SIZE, total - index * SQUASHFS_METADATA_SIZE)
+
+
+def _check_metadata(image, what, start, expected, report):
+    """Decompress the metadata block at `start` and return its size and the position
+    of the next one, or None after adding a Problem to `report`.
+    """
+    report.blocks += 1
+    try:
+        block, next_ = image._read_block(start, expected or SQUASHFS_METADATA_SIZE)
+    except Exception as e:
+        report.problems.append(Problem(what, start, "decompression failed: {}".format(e)))
+        return None
+    if next_ > image.sblk.bytes_used:
+        report.problems.append(Problem(what, start, "ends past the end of the file system"))
+        return None
+    if expected is not None and len(block) != expected:
+        report.problems.append(Problem(what, start, "{} bytes instead of {}".format(len(block), expected)))
+        return None
+    return len(block), next_
+
+
+def _check_chain(image, what, start, end, report):
+    """Check the metadata blocks stored one after the other from `start` to `end`,
+    all of them being full but the last one.
+    """
+    while start < end:
+        result = _check_metadata(image, what, start, None, report)
+        if result is None:
+            return
+        size, next_ = result
+        if next_ > end:
+            report.problems.append(Problem(what, start, "overlaps the next table"))
+            return
+        if next_ < end and size != SQUASHFS_METADATA_SIZE:
+            report.problems.append(Problem(what, start, "{} bytes instead of {}".format(size, SQUASHFS_METADATA_SIZE)))
+            return
+        start = next_
+
+
+def _check_metadata_tables(image, report):
+    sblk = image.sblk
+    tables = []  # (name, index position, size in bytes)
+    if sblk.fragments:
+        tables.append(("fragment table", sblk.fragment_table_start, SQUASHFS_FRAGMENT_BYTES(sblk.fragments)))
+    if sblk.lookup_table_start != SQUASHFS_INVALID_BLK:
+        tables.append(("lookup table", sblk.lookup_table_start, SQUASHFS_LOOKUP_BYTES(sblk.inodes)))
+    tables.append(("id table", sblk.id_table_start, SQUASHFS_ID_BYTES(sblk.no_ids)))
+    xattr_ids = image._xattr_ids
+    if sblk.xattr_id_table_start != SQUASHFS_INVALID_BLK and xattr_ids:
+        tables.append((
+            "xattr id table", sblk.xattr_id_table_start + sizeof(XattrTable), SQUASHFS_XATTR_BYTES(len(xattr_ids))
+        ))
+    # Every table is followed by its index, find where each table starts.
+    starts = [start for _, start, _ in tables]
+    for name, start, total in tables:
+        try:
+            index = read_index(image, start, total)
+        except Exception as e:
+            report.problems.append(Problem(name, start, "unreadable index: {}".format(e)))
+            continue
+        starts.extend(index)
+        for i, position in enumerate(index):
+            _check_metadata(image, name, position, _metadata_size(total, i), report)
+    if image._xattr_table_start is not None:
+        starts.append(image._xattr_table_start)
+        end = min([start for start in starts if start > image._xattr_table_start] + [sblk.bytes_used])
+        _check_chain(image, "xattr table", image._xattr_table_start, end, report)
+    end = min([start for start in starts if start > sblk.directory_table_start] + [sblk.bytes_used])
+    _check_chain(image, "inode table", sblk.inode_table_start, sblk.directory_table_start, report)
+    _check_chain(image, "directory table", sblk.directory_table_start, end, report)
+
+
+def _collect_blocks(image):
+    """Map every data block and fragment block of the image to the paths of the files using it.
+
+    Data blocks are identified by (position, size on disk, expected size),
+    so blocks shared by duplicate files are only listed once, and fragment blocks
+    by their index in the fragment table, along with the size the files need them to have.
+    """
+    block_size = image.sblk.block_size
+    blocks = OrderedDict()
+    fragments = OrderedDict()
+    links = {}  # Inode number -> path lists of the blocks of that inode.
+    for file in image.root.riter():
+        if not file.is_file:
+            continue
+        inode = file.inode
+        if inode.nlink > 1 and inode.inode_number in links:
+            for files in links[inode.inode_number]:
+                files.append(file.path)
+            continue
+        lists = []
+        start = inode.start
+        if inode.blocks:
+            block_list = image._read_block_list(inode.block_start, inode.block_offset, inode.blocks)
+            for i, block in enumerate(block_list):
+                if block == SQUASHFS_INVALID_FRAG or not block:
+                    continue
+                key = (start, block, min(block_size, inode.data - i * block_size))
+                start += SQUASHFS_COMPRESSED_SIZE_BLOCK(block)
+                lists.append(blocks.setdefault(key, []))
+        if inode.frag_bytes:
+            needed, files = fragments.get(inode.fragment, (0, []))
+            fragments[inode.fragment] = max(needed, inode.offset + inode.frag_bytes), files
+            lists.append(files)
+        for files in lists:
+            files.append(file.path)
+        if inode.nlink > 1:
+            links[inode.inode_number] = lists
+    return blocks, fragments
+
+
+def _check_block(image, start, size, minimum, maximum):
+    """Return why the data block at `start` is bad or None."""
+    c_size = SQUASHFS_COMPRESSED_SIZE_BLOCK(size)
+    if c_size > image.sblk.block_size:
+        return "invalid size {}".format(c_size)
+    if start + c_size > image.sblk.bytes_used:
+        return "ends past the end of the file system"
+    data = image._read(start, c_size)
+    if len(data) != c_size:
+        return "truncated"
+    if SQUASHFS_COMPRESSED_BLOCK(size):
+        try:
+            data = image._uncompress(data, c_size, image.sblk.block_size)
+        except Exception as e:
+            return "decompression failed: {}".format(e)
+    if not minimum <= len(data) <= maximum:
+        if minimum == maximum:
+            return "{} bytes instead of {}".format(len(data), minimum)
+        return "{} bytes instead of {} to {}".format(len(data), minimum, maximum)
+    return None
+
+
+def verify(image, jobs=1):
+    """Check that every metadata block, data block and fragment block of `image`
+    can be read and decompressed to the expected size, decompressing each of them once.
+
+    Data and fragment blocks are checked with `jobs` threads.
+    Return a Report listing the problems found with the files they affect.
+    """
+    report = Report()
+    bytes_used = image.sblk.bytes_used
+    if len(image._read(bytes_used - 1, 1)) != 1:
+        report.problems.append(Problem("end of the file system", bytes_used, "image is truncated"))
+    _check_metadata_tables(image, report)
+    blocks, fragments = _collect_blocks(image)
+    checks = []
+    for (start, size, expected), files in blocks.items():
+        checks.append(("data block", start, size, expected, expected, files))
+    for index, (needed, files) in fragments.items():
+        if index >= len(image._fragment_table):
+            report.problems.append(Problem("fragment table", 0, "no fragment #{}".format(index), files))
+            continue
+        start, size = image._read_fragment(index)
+        checks.append(("fragment block", start, size, needed, image.sblk.block_size, files))
+
+    def check(item):
+        return _check_block(image, *item[1:5])
+
+    if jobs > 1 and ThreadPoolExecutor is not None:
+        with ThreadPoolExecutor(jobs) as executor:
+            results = list(executor.map(check, checks))
+    else:
+        results = [check(item) for item in checks]
+    report.blocks += len(checks)
+    for item, message in zip(checks, results):
+        if message is not None:
+            report.problems.append(Problem(item[0], item[1], message, item[5]))
+    return report
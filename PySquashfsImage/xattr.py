@@ -1,7 +1,21 @@
+import os
 import sys
+from errno import EPERM
 
 from .const import SQUASHFS_INVALID_BLK, SQUASHFS_INVALID_XATTR
 
+try:
+    from errno import ENOTSUP, EOPNOTSUPP
+except ImportError:
+    ENOTSUP = EOPNOTSUPP = None
+
+try:
+    from os import geteuid
+except ImportError:
+    _root = False
+else:
+    _root = geteuid() == 0
+
 
 def has_xattrs(file):
     # unsquashfs_xattr.c
@@ -11,7 +25,23 @@ def has_xattrs(file):
     )
 
 
-def write_xattr(pathname, file):
+def write_xattr(pathname, file, fd=None):
+    """Set the extended attributes of `file` on `pathname`, or on the open file descriptor `fd` if given.
+
+    Like unsquashfs, only attributes in the user namespace are written when not root,
+    and attributes the file system doesn't support are ignored.
+    """
     # unsquashfs_xattr.c
     if sys.version_info < (3, 3) or sys.platform != "linux" or not has_xattrs(file):
         return
+    for name, value in file.image._get_xattrs(file.xattr).items():
+        if not _root and not name.startswith("user."):
+            continue
+        try:
+            if fd is not None:
+                os.setxattr(fd, name, value)
+            else:
+                os.setxattr(pathname, name, value, follow_symlinks=False)
+        except OSError as e:
+            if e.errno not in (ENOTSUP, EOPNOTSUPP, EPERM):
+                raise
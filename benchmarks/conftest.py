@@ -0,0 +1,124 @@
+import io
+import random
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+import PySquashfsImage
+
+import corpus
+
+COMPRESSIONS = ["gzip", "lz4", "xz", "zstd", ""]
+BLOCK_SIZES = ["4K", "128K", "1M"]
+
+WORDS = [
+    "squash", "inode", "block", "fragment", "table", "directory", "xattr", "uid",
+    "gid", "mode", "link", "data", "cache", "read", "write", "offset",
+]
+
+# Shape of the image every benchmark runs on.
+DIRECTORIES = 20
+FILES_PER_DIRECTORY = 50
+SMALL_FILE_SIZE = 2048
+LARGE_FILE_SIZE = 8 << 20
+SPARSE_FILE_SIZE = 32 << 20
+DEEP_PATH = "/deep" + "/level" * 16
+
+
+def _text(rng, size):
+    """Return `size` bytes of compressible text."""
+    chunks = []
+    total = 0
+    while total < size:
+        chunk = " ".join(rng.choice(WORDS) for _ in range(1024)).encode() + b"\n"
+        chunks.append(chunk)
+        total += len(chunk)
+    return b"".join(chunks)[:size]
+
+
+def _files(seed=0):
+    """Return the (path, contents) pairs of the benchmark tree."""
+    rng = random.Random(seed)
+    files = []
+    for i in range(DIRECTORIES):
+        for j in range(FILES_PER_DIRECTORY):
+            files.append(("dir{}/small{}.txt".format(i, j), _text(rng, rng.randint(1, 2 * SMALL_FILE_SIZE))))
+    # Half compressible text, half random bytes.
+    large = _text(rng, LARGE_FILE_SIZE // 2)
+    large += bytes(bytearray(rng.getrandbits(8) for _ in range(LARGE_FILE_SIZE // 2)))
+    files.append(("large.bin", large))
+    # Data at both ends of a hole.
+    data = _text(rng, 1 << 20)
+    files.append(("sparse.img", data + b"\0" * (SPARSE_FILE_SIZE - 2 * len(data)) + data))
+    files.append((DEEP_PATH.lstrip('/') + "/leaf.txt", _text(rng, SMALL_FILE_SIZE)))
+    return files
+
+
+def build_image(path, files, options=()):
+    """Build a squashfs image at `path` from (path, contents) pairs with sqfstar,
+    skipping the benchmark if it isn't installed or doesn't support the compressor.
+    """
+    if shutil.which("sqfstar") is None:
+        pytest.skip("sqfstar isn't installed")
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w:', format=tarfile.PAX_FORMAT) as archive:
+        for name, contents in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            info.mtime = 0
+            archive.addfile(info, io.BytesIO(contents))
+    process = subprocess.Popen(
+        ["sqfstar"] + list(options) + [path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    _, error = process.communicate(stream.getvalue())
+    if process.returncode:
+        pytest.skip("sqfstar {} failed: {}".format(" ".join(options), error.decode(errors="replace").strip()))
+
+
+def pytest_addoption(parser):
+    parser.addoption("--corpus-scale", type=float, default=0.01,
+                     help="size of the synthetic images relative to their full size (default: 0.01)")
+
+
+@pytest.fixture(scope="session")
+def files():
+    return _files()
+
+
+@pytest.fixture(scope="session", params=COMPRESSIONS, ids=lambda c: c or "none")
+def compression(request):
+    return request.param
+
+
+@pytest.fixture(scope="session", params=BLOCK_SIZES)
+def block_size(request):
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def image_path(tmp_path_factory, files, compression, block_size):
+    options = ["-comp", compression] if compression else ["-noI", "-noD", "-noF"]
+    path = str(tmp_path_factory.mktemp("images") / "{}-{}.squashfs".format(compression or "none", block_size))
+    build_image(path, files, options + ["-b", block_size])
+    try:
+        PySquashfsImage.SquashFsImage.from_file(path).close()
+    except ImportError as e:
+        pytest.skip("no decompressor: {}".format(e))
+    return path
+
+
+@pytest.fixture
+def image(image_path):
+    with PySquashfsImage.SquashFsImage.from_file(image_path) as image:
+        yield image
+
+
+@pytest.fixture(scope="session", params=sorted(corpus.SHAPES))
+def corpus_path(request):
+    """Path of a cached synthetic image of every shape of corpus.py."""
+    try:
+        return corpus.generate(request.param, scale=request.config.getoption("corpus_scale"))
+    except (OSError, RuntimeError) as e:
+        pytest.skip("can't build the {} image: {}".format(request.param, e))
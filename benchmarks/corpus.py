@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""Reproducible synthetic images for scaling benchmarks and tests.
+
+Each shape stresses one dimension of the format: many inodes, one huge directory,
+a deep tree, a multi-GB sparse file, heavy hard linking or many xattrs.
+Images are built by piping a tar stream to sqfstar, so nothing is staged on disk,
+and cached by shape, parameters and seed:
+
+    $ python benchmarks/corpus.py wide --scale 0.1
+    /home/me/.cache/pysquashfs-corpus/wide-3f1c0d5e8a9b2c47.squashfs
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tarfile
+
+# Bump when a shape changes so that cached images are rebuilt.
+VERSION = 1
+
+CACHE_DIR = os.environ.get(
+    "PYSQUASHFS_CORPUS", os.path.join(os.path.expanduser("~"), ".cache", "pysquashfs-corpus")
+)
+
+
+class _Contents(object):
+    """File-like yielding `size` bytes made of `extents`, (offset, bytes) pairs, and zeros elsewhere."""
+
+    def __init__(self, size, extents=()):
+        self._size = size
+        self._extents = sorted(extents)
+        self._position = 0
+
+    def read(self, size=-1):
+        end = self._size if size < 0 else min(self._size, self._position + size)
+        chunk = bytearray(end - self._position)
+        for offset, data in self._extents:
+            start = max(offset, self._position)
+            stop = min(offset + len(data), end)
+            if start < stop:
+                chunk[start - self._position : stop - self._position] = data[start - offset : stop - offset]
+        self._position = end
+        return bytes(chunk)
+
+
+def _info(name, type_=tarfile.REGTYPE, size=0, mode=0o644):
+    info = tarfile.TarInfo(name)
+    info.type = type_
+    info.size = size
+    info.mode = mode
+    info.mtime = 0
+    info.uname = info.gname = "root"
+    return info
+
+
+def _file(name, data):
+    return _info(name, size=len(data)), _Contents(len(data), [(0, data)])
+
+
+def _directory(name):
+    return _info(name, tarfile.DIRTYPE, mode=0o755), None
+
+
+def _name(rng, length=12):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789_-") for _ in range(length))
+
+
+def _data(rng, size):
+    return rng.getrandbits(8 * size).to_bytes(size, "little") if size else b""
+
+
+def inodes(rng, scale):
+    """Many small files spread over a two-level tree, most with a tiny tail in a fragment."""
+    count = max(1, int(1000000 * scale))
+    per_directory = 1000
+    for i in range(count):
+        directory = "d{:04d}/e{:03d}".format(i // per_directory // 100, i // per_directory % 100)
+        if not i % per_directory:
+            if not i // per_directory % 100:
+                yield _directory(directory.split('/')[0])
+            yield _directory(directory)
+        yield _file("{}/{}".format(directory, _name(rng)), _data(rng, rng.randint(0, 64)))
+
+
+def wide(rng, scale):
+    """A single directory with 100k entries, which needs directory indexes."""
+    yield _directory("wide")
+    names = set()
+    while len(names) < max(1, int(100000 * scale)):
+        names.add(_name(rng, rng.randint(4, 40)))
+    for name in sorted(names):
+        yield _file("wide/" + name, b"")
+
+
+def deep(rng, scale):
+    """A chain of nested directories with a file at every level."""
+    path = ""
+    for i in range(max(1, int(1000 * scale))):
+        path += "{}/".format(_name(rng, 2))
+        yield _directory(path.rstrip('/'))
+        yield _file(path + "f", _data(rng, 16))
+
+
+def sparse(rng, scale):
+    """A multi-GB file that is mostly a hole, with data extents at random offsets."""
+    size = max(1 << 20, int((4 << 30) * scale))
+    extents = [(0, _data(rng, 4096)), (size - 4096, _data(rng, 4096))]
+    for _ in range(16):
+        extents.append((rng.randrange(0, size - (64 << 10)) & ~4095, _data(rng, 64 << 10)))
+    yield _info("sparse.img", size=size), _Contents(size, extents)
+
+
+def links(rng, scale):
+    """Files hard linked many times from several directories."""
+    count = max(1, int(10000 * scale))
+    for directory in ("data", "a", "b", "c"):
+        yield _directory(directory)
+    for i in range(count):
+        name = "data/{}".format(_name(rng))
+        yield _file(name, _data(rng, rng.randint(0, 8192)))
+        for j in range(rng.randint(1, 10)):
+            info = _info("{}/{}-{}".format("abc"[j % 3], i, j), tarfile.LNKTYPE)
+            info.linkname = name
+            yield info, None
+
+
+def xattrs(rng, scale):
+    """Files with xattrs drawn from a few distinct sets, like SELinux labels and capabilities."""
+    sets = []
+    for i in range(64):
+        values = {"security.selinux": "system_u:object_r:{}_t:s0".format(_name(rng, 8))}
+        for _ in range(rng.randint(0, 6)):
+            values["user." + _name(rng, 6)] = _name(rng, rng.randint(1, 64))
+        if not i % 8:
+            values["security.capability"] = "\x01\x00\x00\x02" + "\x00" * 16
+        sets.append(values)
+    yield _directory("files")
+    for _ in range(max(1, int(10000 * scale))):
+        info, contents = _file("files/" + _name(rng), _data(rng, rng.randint(0, 256)))
+        info.pax_headers = {"SCHILY.xattr." + key: value for key, value in rng.choice(sets).items()}
+        yield info, contents
+
+
+SHAPES = {shape.__name__: shape for shape in (inodes, wide, deep, sparse, links, xattrs)}
+
+
+def generate(shape, seed=0, scale=1.0, options=("-comp", "gzip"), cache_dir=None):
+    """Return the path of the image of `shape`, one of SHAPES, building it if it isn't cached.
+
+    `scale` multiplies the size of the shape, 1 being the full size, `seed` seeds the contents
+    and `options` are passed to sqfstar.
+    """
+    if shape not in SHAPES:
+        raise ValueError("unknown shape {!r}, expected one of {}".format(shape, ", ".join(sorted(SHAPES))))
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    key = json.dumps([VERSION, shape, seed, scale, list(options)])
+    path = os.path.join(cache_dir, "{}-{}.squashfs".format(shape, hashlib.sha1(key.encode()).hexdigest()[:16]))
+    if os.path.exists(path):
+        return path
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    partial = "{}.{}.tmp".format(path, os.getpid())
+    # Fixed times make the image depend on the parameters only, not on when it was built.
+    process = subprocess.Popen(
+        ["sqfstar", "-mkfs-time", "0", "-all-time", "0"] + list(options) + [partial],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+    )
+    try:
+        with tarfile.open(fileobj=process.stdin, mode="w|", format=tarfile.PAX_FORMAT) as archive:
+            for info, contents in SHAPES[shape](random.Random(seed), scale):
+                archive.addfile(info, contents)
+        process.stdin.close()
+        if process.wait():
+            raise RuntimeError("sqfstar exited with status {}".format(process.returncode))
+        # Concurrent builds of the same image produce the same file.
+        os.rename(partial, path)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if os.path.exists(partial):
+            os.remove(partial)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build synthetic squashfs images and print their paths.")
+    parser.add_argument("shapes", nargs='*', metavar="shape",
+                        help="one or more of {} (default: all)".format(", ".join(sorted(SHAPES))))
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("--scale", type=float, default=1.0, help="size relative to the full shape")
+    parser.add_argument("-c", "--comp", default="gzip", help="sqfstar compressor")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+    for shape in args.shapes or sorted(SHAPES):
+        print(generate(shape, args.seed, args.scale, ["-comp", args.comp], args.cache_dir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
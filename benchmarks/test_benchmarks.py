@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from PySquashfsImage import SquashFsImage
+from PySquashfsImage.extract import extract_dir
+
+pytest.importorskip("pytest_benchmark")
+
+
+def _throughput(benchmark, size):
+    benchmark.extra_info["bytes"] = size
+
+
+def test_open(benchmark, image_path):
+    def open_image():
+        SquashFsImage.from_file(image_path).close()
+
+    benchmark(open_image)
+
+
+@pytest.mark.parametrize("which", ["top", "nested", "deep"])
+def test_select(benchmark, image, files, which):
+    path = {"top": "/large.bin", "nested": "/dir19/small49.txt", "deep": '/' + files[-1][0]}[which]
+    assert benchmark(image.select, path) is not None
+
+
+def test_iterate(benchmark, image, files):
+    count = benchmark(lambda: sum(1 for _ in image))
+    assert count >= len(files)
+
+
+def test_read_small(benchmark, image, files):
+    small = [image.select('/' + name) for name, _ in files if name.startswith("dir")]
+    _throughput(benchmark, sum(file.size for file in small))
+
+    def read_all():
+        for file in small:
+            file.read_bytes()
+
+    # Clearing the cache before each round makes every read decompress its blocks again.
+    benchmark.pedantic(read_all, setup=image._data_cache.clear, rounds=5)
+
+
+@pytest.mark.parametrize("path", ["/large.bin", "/sparse.img"])
+def test_read_large(benchmark, image, path):
+    file = image.select(path)
+    _throughput(benchmark, file.size)
+    assert len(benchmark.pedantic(file.read_bytes, setup=image._data_cache.clear, rounds=5)) == file.size
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_extract_dir(benchmark, image, files, jobs):
+    _throughput(benchmark, sum(len(contents) for _, contents in files))
+    tmpdir = tempfile.mkdtemp()
+    dest = os.path.join(tmpdir, "root")
+
+    def setup():
+        image._data_cache.clear()
+        shutil.rmtree(dest, ignore_errors=True)
+
+    try:
+        benchmark.pedantic(extract_dir, args=(image.root, dest), kwargs={"jobs": jobs}, setup=setup, rounds=3)
+    finally:
+        shutil.rmtree(tmpdir)
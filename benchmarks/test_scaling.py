@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from PySquashfsImage import SquashFsImage
+from PySquashfsImage.extract import extract_dir
+
+pytest.importorskip("pytest_benchmark")
+
+
+def test_open_scaled(benchmark, corpus_path):
+    def open_image():
+        SquashFsImage.from_file(corpus_path).close()
+
+    benchmark.pedantic(open_image, rounds=3)
+
+
+def test_iterate_scaled(benchmark, corpus_path):
+    with SquashFsImage.from_file(corpus_path) as image:
+        benchmark.pedantic(lambda: sum(1 for _ in image), rounds=3)
+
+
+def test_extract_scaled(benchmark, corpus_path):
+    tmpdir = tempfile.mkdtemp()
+    dest = os.path.join(tmpdir, "root")
+
+    try:
+        with SquashFsImage.from_file(corpus_path) as image:
+            def setup():
+                image._data_cache.clear()
+                shutil.rmtree(dest, ignore_errors=True)
+
+            benchmark.pedantic(extract_dir, args=(image.root, dest), setup=setup, rounds=1)
+    finally:
+        shutil.rmtree(tmpdir)